@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from .suite import compare, run
+
+DEFAULT_OUTPUT = os.path.join("benchmark", "results", "latest.json")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Time the services and routes on top of in-memory fakes.",
+    )
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="callers running each case at once"
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="delay every fake adds per call",
+    )
+    parser.add_argument(
+        "--ml-latency-ms",
+        type=float,
+        default=None,
+        help="delay of the prediction Space, defaults to --latency-ms",
+    )
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument(
+        "--trace-file", help="also write the traces of every call to this file"
+    )
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="allowed p50 growth over the baseline, 0.2 is 20%%",
+    )
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        run(
+            iterations=args.iterations,
+            warmup=args.warmup,
+            concurrency=args.concurrency,
+            latency=args.latency_ms / 1000,
+            ml_latency=(
+                None if args.ml_latency_ms is None else args.ml_latency_ms / 1000
+            ),
+            only=args.only,
+            trace_file=args.trace_file,
+        )
+    )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+
+    if baseline["params"] != report["params"]:
+        print("warning: the baseline was recorded with different parameters")
+
+    regressions = compare(report, baseline, args.max_regression)
+    for regression in regressions:
+        print("REGRESSION", regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
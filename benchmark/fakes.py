@@ -0,0 +1,629 @@
+import asyncio
+import base64
+import contextlib
+import copy
+import datetime
+import json
+import operator
+import time
+import types
+import zlib
+from collections import defaultdict
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+import httpx
+import shortuuid
+from fastapi import HTTPException
+from firebase_admin import auth
+from google.cloud import firestore
+from google.cloud.exceptions import NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from service.foods import FOOD_CSV, iter_food_documents
+from service.gcp.firestore import Firestore
+from service.gcp.identity import IdentityToolkit
+from service.image import (
+    DEFAULT_FORMAT,
+    DEFAULT_MAX_PHOTO_BYTES,
+    DEFAULT_MAX_SIDE,
+    SNIFF_BYTES,
+    sniff_content_type,
+)
+from service.jobs import DEFAULT_MAX_QUEUED, DEFAULT_WORKERS
+from service.machine_learning.app import MLPredictions
+
+TOKEN_LIFETIME_SECONDS = 3600
+# the ops the app's queries filter with
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class FakeFirestoreClient:
+    """
+    In-memory stand-in for firestore.AsyncClient, so the real
+    service.gcp.firestore.Firestore runs on top of it: batched get_all
+    reads, keyset queries, transactions and Increment included.
+
+    Documents are kept in `documents` by collection and id. Every round
+    trip sleeps `latency` seconds first and is counted in `calls` by kind.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.documents: Dict[str, Dict[str, Dict]] = defaultdict(dict)
+        self.calls: Dict[str, int] = defaultdict(int)
+        # held by a transaction from begin to commit, as if it locked every
+        # document it reads
+        self.transaction_lock = asyncio.Lock()
+
+    def collection(self, name: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self, name)
+
+    def transaction(self) -> "FakeTransaction":
+        return FakeTransaction(self)
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        await self.round_trip("get_all")
+        for reference in references:
+            yield reference.snapshot()
+
+    async def round_trip(self, kind: str):
+        self.calls[kind] += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[Dict]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.__data = data
+
+    def to_dict(self) -> Optional[Dict]:
+        return copy.deepcopy(self.__data)
+
+    def get(self, field_path: str) -> Any:
+        return copy.deepcopy(self.__data[field_path])
+
+
+class FakeDocumentReference:
+    def __init__(self, client: FakeFirestoreClient, collection: str, id: str):
+        self.client = client
+        self.collection = collection
+        self.id = id
+        self.path = f"{collection}/{id}"
+
+    async def get(self, field_paths=None, transaction=None) -> FakeSnapshot:
+        await self.client.round_trip("get")
+        return self.snapshot()
+
+    async def set(self, document_data: Dict, merge: bool = False):
+        await self.client.round_trip("set")
+        self.write(document_data, merge=merge)
+
+    async def update(self, field_updates: Dict):
+        await self.client.round_trip("update")
+        self.write(field_updates, merge=True, must_exist=True)
+
+    def snapshot(self) -> FakeSnapshot:
+        data = self.client.documents[self.collection].get(self.id)
+        return FakeSnapshot(self, copy.deepcopy(data))
+
+    def write(self, data: Dict, merge: bool, must_exist: bool = False):
+        documents = self.client.documents[self.collection]
+        if must_exist and self.id not in documents:
+            raise NotFound(f"No document to update: {self.path}")
+
+        document = documents.get(self.id, {}) if merge else {}
+        for field, value in data.items():
+            if isinstance(value, transforms.Increment):
+                document[field] = document.get(field, 0) + value.value
+            elif isinstance(value, datetime.datetime):
+                # read back in UTC, like a Firestore timestamp
+                document[field] = value.astimezone(datetime.timezone.utc)
+            else:
+                document[field] = copy.deepcopy(value)
+
+        documents[self.id] = document
+
+
+class FakeQuery:
+    def __init__(
+        self,
+        client: FakeFirestoreClient,
+        collection: str,
+        filters: Tuple = (),
+        orders: Tuple = (),
+        cursor: Optional[Dict] = None,
+        count: Optional[int] = None,
+    ):
+        self.client = client
+        self.collection = collection
+        self.filters = filters
+        self.orders = orders
+        self.cursor = cursor
+        self.count = count
+
+    def where(self, filter: FieldFilter) -> "FakeQuery":
+        return self.__replace(filters=self.filters + (filter,))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        descending = direction == firestore.Query.DESCENDING
+        return self.__replace(orders=self.orders + ((field_path, descending),))
+
+    def start_after(self, document_fields: Dict) -> "FakeQuery":
+        return self.__replace(cursor=document_fields)
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self.__replace(count=count)
+
+    async def get(self, transaction=None) -> List[FakeSnapshot]:
+        await self.client.round_trip("query")
+        return self.__run()
+
+    async def stream(self, transaction=None):
+        await self.client.round_trip("query")
+        for snapshot in self.__run():
+            yield snapshot
+
+    def __run(self) -> List[FakeSnapshot]:
+        documents = self.client.documents[self.collection]
+        ids = [id for id, data in documents.items() if self.__matches(data)]
+
+        # stable sorts, the last order first
+        for field_path, descending in reversed(self.orders):
+            ids.sort(
+                key=lambda id: self.__value(id, documents[id], field_path),
+                reverse=descending,
+            )
+
+        if self.cursor is not None:
+            ids = [id for id in ids if self.__after(id, documents[id])]
+
+        return [
+            FakeDocumentReference(self.client, self.collection, id).snapshot()
+            for id in ids[: self.count]
+        ]
+
+    def __matches(self, data: Dict) -> bool:
+        for f in self.filters:
+            if f.field_path not in data:
+                return False
+            if not OPERATORS[f.op_string](data[f.field_path], f.value):
+                return False
+
+        # Firestore leaves out documents without an ordered field
+        return all(
+            field_path == FieldPath.document_id() or field_path in data
+            for field_path, _ in self.orders
+        )
+
+    def __after(self, id: str, data: Dict) -> bool:
+        for field_path, descending in self.orders:
+            if field_path not in self.cursor:
+                break
+
+            value = self.__value(id, data, field_path)
+            bound = self.cursor[field_path]
+            if field_path == FieldPath.document_id() and not isinstance(bound, str):
+                bound = bound.id
+
+            if value != bound:
+                return value < bound if descending else value > bound
+
+        return False
+
+    def __value(self, id: str, data: Dict, field_path: str) -> Any:
+        if field_path == FieldPath.document_id():
+            return id
+
+        return data[field_path]
+
+    def __replace(self, **changes) -> "FakeQuery":
+        fields = {
+            "filters": self.filters,
+            "orders": self.orders,
+            "cursor": self.cursor,
+            "count": self.count,
+        }
+        fields.update(changes)
+        return FakeQuery(self.client, self.collection, **fields)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: FakeFirestoreClient, name: str):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        if document_id is None:
+            document_id = shortuuid.uuid()
+
+        return FakeDocumentReference(self.client, self.id, document_id)
+
+
+class FakeTransaction:
+    """
+    A transaction for firestore.async_transactional, which drives it
+    through the hooks an AsyncTransaction has (_begin, _commit, ...).
+    Writes are buffered and applied at commit; from begin to commit or
+    rollback the transaction holds the client's lock.
+    """
+
+    _max_attempts = 5
+    _read_only = False
+
+    def __init__(self, client: FakeFirestoreClient):
+        self.client = client
+        self._id: Optional[bytes] = None
+        self.writes: List[Callable[[], None]] = []
+        self.locked = False
+
+    def set(self, reference: FakeDocumentReference, document_data: Dict, merge=False):
+        self.writes.append(lambda: reference.write(document_data, merge=merge))
+
+    def update(self, reference: FakeDocumentReference, field_updates: Dict):
+        self.writes.append(
+            lambda: reference.write(field_updates, merge=True, must_exist=True)
+        )
+
+    def _clean_up(self):
+        self.writes = []
+        self._id = None
+
+    async def _begin(self, retry_id: Optional[bytes] = None):
+        await self.client.transaction_lock.acquire()
+        self.locked = True
+
+        await self.client.round_trip("begin_transaction")
+        self._id = shortuuid.uuid().encode()
+
+    async def _commit(self):
+        await self.client.round_trip("commit")
+        for write in self.writes:
+            write()
+
+        self._clean_up()
+        self.__release()
+
+    async def _rollback(self):
+        self._clean_up()
+        self.__release()
+
+    def __release(self):
+        if self.locked:
+            self.locked = False
+            self.client.transaction_lock.release()
+
+
+class FakeStorage:
+    """
+    In-memory stand-in for service.gcp.storage.Storage. Blobs are kept in
+    `blobs` by name, and every call sleeps `latency` seconds first.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str = "bench-bucket",
+        max_upload_bytes: int = DEFAULT_MAX_PHOTO_BYTES,
+        latency: float = 0.0,
+    ):
+        self.bucket_name = bucket_name
+        self.max_upload_bytes = max_upload_bytes
+        self.latency = latency
+        # name -> (data, generation)
+        self.blobs: Dict[str, Tuple[bytes, int]] = {}
+        self.generation = 0
+
+    async def start(self):
+        await asyncio.sleep(self.latency)
+
+    async def store(
+        self, path: str, file: BinaryIO, content_type: str
+    ) -> Tuple[str, int]:
+        head = file.read(SNIFF_BYTES)
+        if sniff_content_type(head) is None:
+            raise HTTPException(
+                status_code=415, detail="Only JPEG, PNG or WebP photos are allowed"
+            )
+
+        data = head + file.read()
+        if len(data) > self.max_upload_bytes:
+            raise HTTPException(status_code=413, detail="Photo is too large")
+
+        await asyncio.sleep(self.latency)
+
+        name = f"{path}/{shortuuid.uuid()}"
+        self.generation += 1
+        self.blobs[name] = (data, self.generation)
+        return (
+            f"https://storage.googleapis.com/{self.bucket_name}/{name}",
+            self.generation,
+        )
+
+    async def destroy(self, path: str, user_id: str):
+        await self.destruct(path=f"{user_id}/profile", photo_id=path)
+
+    async def destruct(
+        self, path: str, photo_id: str, generation: Optional[int] = None
+    ):
+        await self.delete(f"{path}/{photo_id}", generation=generation)
+
+    async def delete(self, name: str, generation: Optional[int] = None) -> bool:
+        await asyncio.sleep(self.latency)
+
+        blob = self.blobs.get(name)
+        if blob is not None and generation is not None and blob[1] != generation:
+            return False
+
+        self.blobs.pop(name, None)
+        return True
+
+    async def delete_many(self, blobs: List[Tuple[str, Optional[int]]]) -> List[str]:
+        await asyncio.sleep(self.latency)
+
+        failed = []
+        for name, generation in blobs:
+            blob = self.blobs.get(name)
+            if blob is not None and generation is not None and blob[1] != generation:
+                failed.append(name)
+            else:
+                self.blobs.pop(name, None)
+
+        return failed
+
+
+class FakeAuth:
+    """
+    Firebase Auth in memory.
+
+    `transport()` answers the identity REST endpoints for IdentityToolkit,
+    and `install()` patches the firebase_admin.auth calls the app makes.
+    Those run in the threadpool, so their latency blocks a thread like the
+    real SDK does.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.accounts: Dict[str, Dict] = {}
+
+    def add_account(
+        self, uid: str, email: str, password: str, display_name: str
+    ) -> Dict:
+        account = {
+            "uid": uid,
+            "email": email,
+            "password": password,
+            "display_name": display_name,
+            "photo_url": "",
+        }
+        self.accounts[uid] = account
+        return account
+
+    def id_token(self, uid: str) -> str:
+        claims = {"uid": uid, "exp": int(time.time()) + TOKEN_LIFETIME_SECONDS}
+        return "fake." + base64.urlsafe_b64encode(json.dumps(claims).encode()).decode()
+
+    def refresh_token(self, uid: str) -> str:
+        return f"refresh.{uid}"
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.__handle)
+
+    @contextlib.contextmanager
+    def install(self):
+        with mock.patch.multiple(
+            auth,
+            verify_id_token=self.__verify_id_token,
+            create_user=self.__create_user,
+            update_user=self.__update_user,
+            revoke_refresh_tokens=self.__revoke_refresh_tokens,
+        ):
+            yield
+
+    async def __handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+
+        body = json.loads(request.content)
+
+        if request.url.path.endswith("accounts:signInWithPassword"):
+            account = self.__find_by_email(body["email"])
+            if account is None:
+                return self.__error("EMAIL_NOT_FOUND")
+            if account["password"] != body["password"]:
+                return self.__error("INVALID_PASSWORD")
+
+            return httpx.Response(
+                200,
+                json={
+                    "localId": account["uid"],
+                    "email": account["email"],
+                    "displayName": account["display_name"],
+                    "idToken": self.id_token(account["uid"]),
+                    "refreshToken": self.refresh_token(account["uid"]),
+                    "expiresIn": str(TOKEN_LIFETIME_SECONDS),
+                },
+            )
+
+        if request.url.path.endswith("/v1/token"):
+            uid = body["refreshToken"].split(".", 1)[-1]
+            if uid not in self.accounts:
+                return self.__error("INVALID_REFRESH_TOKEN")
+
+            return httpx.Response(
+                200,
+                json={
+                    "user_id": uid,
+                    "id_token": self.id_token(uid),
+                    "refresh_token": self.refresh_token(uid),
+                    "expires_in": str(TOKEN_LIFETIME_SECONDS),
+                },
+            )
+
+        return httpx.Response(404)
+
+    def __error(self, message: str) -> httpx.Response:
+        return httpx.Response(400, json={"error": {"code": 400, "message": message}})
+
+    def __find_by_email(self, email: str) -> Optional[Dict]:
+        for account in self.accounts.values():
+            if account["email"] == email:
+                return account
+
+        return None
+
+    def __verify_id_token(self, id_token: str, app=None, check_revoked=False):
+        time.sleep(self.latency)
+
+        try:
+            prefix, encoded = id_token.split(".", 1)
+            claims = json.loads(base64.urlsafe_b64decode(encoded))
+            account = self.accounts[claims["uid"]]
+        except (KeyError, TypeError, ValueError):
+            raise auth.InvalidIdTokenError("invalid token")
+
+        return {
+            "user_id": account["uid"],
+            "name": account["display_name"],
+            "email": account["email"],
+            "picture": account["photo_url"],
+            "exp": claims["exp"],
+        }
+
+    def __create_user(self, app=None, **kwargs):
+        time.sleep(self.latency)
+
+        if self.__find_by_email(kwargs["email"]) is not None:
+            raise auth.EmailAlreadyExistsError("email already exists", None, None)
+
+        account = self.add_account(
+            uid=shortuuid.uuid(),
+            email=kwargs["email"],
+            password=kwargs["password"],
+            display_name=kwargs.get("display_name", ""),
+        )
+        return types.SimpleNamespace(uid=account["uid"])
+
+    def __update_user(self, uid: str, app=None, **kwargs):
+        time.sleep(self.latency)
+
+        account = self.accounts.get(uid)
+        if account is None:
+            raise auth.UserNotFoundError("user not found")
+
+        if "display_name" in kwargs:
+            account["display_name"] = kwargs["display_name"]
+        if "photo_url" in kwargs:
+            account["photo_url"] = kwargs["photo_url"]
+
+        return types.SimpleNamespace(uid=uid)
+
+    def __revoke_refresh_tokens(self, uid: str, app=None):
+        time.sleep(self.latency)
+
+
+class FakeSpace:
+    """
+    Gradio Space answering `/run/predict` as an httpx transport for
+    MLPredictions. The label is derived from the photo bytes, so the same
+    photo always gets the same answer.
+    """
+
+    def __init__(self, labels: List[str], latency: float = 0.0):
+        self.labels = labels
+        self.latency = latency
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.__handle)
+
+    async def __handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+
+        if request.url.path.endswith("/config"):
+            return httpx.Response(200, json={})
+
+        data = json.loads(request.content)["data"]
+        first = zlib.crc32(data[0].encode()) % len(self.labels)
+        confidences = [
+            {
+                "label": self.labels[(first + i) % len(self.labels)],
+                "confidence": 0.9 / (i + 1),
+            }
+            for i in range(3)
+        ]
+
+        return httpx.Response(
+            200,
+            json={
+                "data": [{"label": confidences[0]["label"], "confidences": confidences}]
+            },
+        )
+
+
+class FakeConfig:
+    """
+    Same attributes as config.Config, with every outside service swapped
+    for an in-memory fake. The Firestore wrapper is the real one, on top of
+    FakeFirestoreClient. `latency` is the delay each fake adds per call, in
+    seconds.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        ml_latency: Optional[float] = None,
+        foods_path: str = FOOD_CSV,
+        daily_quota_limit: int = 10**9,
+        trace_file: Optional[str] = None,
+    ):
+        foods = list(iter_food_documents(foods_path))
+
+        self.api_key = "bench-api-key"
+        self.auth = FakeAuth(latency=latency)
+        self.identity = IdentityToolkit(
+            api_key=self.api_key, transport=self.auth.transport()
+        )
+        self.firebase_app = None
+        self.project_id = "bench-project"
+        self.bucket_name = "bench-bucket"
+        self.max_photo_bytes = DEFAULT_MAX_PHOTO_BYTES
+        self.storage = FakeStorage(
+            bucket_name=self.bucket_name,
+            max_upload_bytes=self.max_photo_bytes,
+            latency=latency,
+        )
+        self.firestore = FakeFirestoreClient(latency=latency)
+        self.firestore.documents["global_id_for_ml"]["id"] = {"current": "UNT001"}
+        for food in foods:
+            self.firestore.documents["food_collection"][food["name"]] = food
+        self.firestore_app = Firestore(connect=lambda: self.firestore)
+        self.space = FakeSpace(
+            labels=[food["name"] for food in foods],
+            latency=latency if ml_latency is None else ml_latency,
+        )
+        self.ml = MLPredictions(
+            food_prediction_api="bench/food-prediction",
+            transport=self.space.transport(),
+        )
+        self.prediction_cache_dir = None
+        self.image_max_side = DEFAULT_MAX_SIDE
+        self.image_format = DEFAULT_FORMAT
+        self.image_workers = None
+        self.daily_quota_limit = daily_quota_limit
+        self.trace_file = trace_file
+        self.trace_min_duration_ms = 0.0
+        self.food_csv = foods_path
+        self.recommendation_workers = DEFAULT_WORKERS
+        self.max_queued_recommendations = DEFAULT_MAX_QUEUED
+
+    async def start_firebase(self):
+        await asyncio.sleep(self.auth.latency)
@@ -0,0 +1,438 @@
+import asyncio
+import datetime
+import io
+import math
+import platform
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+from PIL import Image
+
+from endpoint.security import User
+from server import create_app
+from service.gcp.firestore import ML_ID_BLOCK_SIZE
+
+from .fakes import FakeConfig
+
+# a case gets the iteration number, so it can use a fresh photo or email
+Case = Callable[[int], Awaitable[Any]]
+
+# about what a phone camera hands over after the app's own resize
+PHOTO_SIZE = (1600, 1200)
+HISTORY_SIZE = 25
+HISTORY_PAGE_SIZE = 10
+SIGNUPS = 25
+
+USER_ID = "bench-user"
+USER_NAME = "Bench User"
+USER_EMAIL = "bench@example.com"
+USER_PASSWORD = "bench-password"
+
+
+def expect(condition: bool, message: str):
+    if not condition:
+        raise RuntimeError(f"check failed: {message}")
+
+
+def make_photo(size=PHOTO_SIZE) -> bytes:
+    # noise doesn't compress, so every photo decodes like a real one and
+    # has different bytes
+    img = Image.effect_noise(size, 48).convert("RGB")
+
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class Bench:
+    """
+    The app from server.create_app on top of FakeConfig, with one signed up
+    user that has a filled profile and a nutrition history.
+    """
+
+    def __init__(self, config: FakeConfig, photos: int):
+        self.config = config
+        self.app = create_app(config)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app), base_url="http://bench"
+        )
+        self.photo = make_photo()
+        self.photos = [make_photo() for _ in range(photos)]
+
+    async def setup(self):
+        await self.app.router.startup()
+        await self.app.state.readiness.wait()
+
+        db = self.config.firestore_app
+        self.config.auth.add_account(USER_ID, USER_EMAIL, USER_PASSWORD, USER_NAME)
+        await db.init_user_detail(USER_ID)
+        await db.save_user_detail(
+            weight=60,
+            height=170,
+            sex="M",
+            calories_target=2000,
+            age=25,
+            eat_per_day=3,
+            user_id=USER_ID,
+        )
+        for i in range(HISTORY_SIZE):
+            await db.save_nutrition_data(
+                user_id=USER_ID,
+                img_url=f"https://storage.googleapis.com/bench-bucket/{i}",
+            )
+        await self.app.state.nutrition_service.generate_recommendation(USER_ID)
+
+        self.token = self.config.auth.id_token(USER_ID)
+        self.refresh_token = self.config.auth.refresh_token(USER_ID)
+        self.user = User(
+            id_user=USER_ID,
+            name=USER_NAME,
+            email=USER_EMAIL,
+            photo_url="",
+            auth_token=self.token,
+        )
+
+    async def verify(self):
+        # Timings of wrong answers are worth nothing: the results of the
+        # Firestore paths the cases time are checked once before they run.
+        db = self.config.firestore_app
+        calls = self.config.firestore.calls
+        nutrition = self.app.state.nutrition_service
+        settings = self.app.state.settings_service
+
+        # the history pages through every photo once, one query a page
+        seen = []
+        cursor = None
+        queries = calls["query"]
+        while True:
+            page = (
+                await self.__scoped(
+                    settings.get_upload_nutrition_photo_history(
+                        USER_ID, cursor=cursor, page_size=HISTORY_PAGE_SIZE
+                    )
+                )
+            )["data"]
+            seen += [photo["nutrition_id"] for photo in page["photos"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        pages = math.ceil(HISTORY_SIZE / HISTORY_PAGE_SIZE)
+        expect(len(seen) == HISTORY_SIZE, f"history has {len(seen)} photos")
+        expect(len(set(seen)) == HISTORY_SIZE, "history repeats a photo")
+        expect(calls["query"] - queries == pages, "history reads more than a query")
+
+        invalid = await settings.get_upload_nutrition_photo_history(
+            USER_ID, cursor="not-a-cursor"
+        )
+        expect(invalid["code"] == 400, "an invalid cursor isn't a 400")
+
+        # reads issued together in a request go out as one get_all
+        get_alls, gets = calls["get_all"], calls["get"]
+        with db.request_scope():
+            profile, _ = await asyncio.gather(
+                db.read_user_detail(USER_ID), db.get_recommendation_food(USER_ID)
+            )
+        expect(profile[0]["calories_target"] == 2000, "profile isn't the saved one")
+        expect(calls["get_all"] - get_alls == 1, "reads weren't batched")
+        expect(calls["get"] == gets, "a batched read went out on its own")
+
+        # a scan is priced from the catalog, and counts against the quota
+        used = (await nutrition.get_count_photo_today(USER_ID))["data"]["count"]
+        scan = (
+            await self.__scoped(
+                nutrition.predict_food(
+                    io.BytesIO(self.photo), "image/jpeg", user_id=USER_ID, keep=True
+                )
+            )
+        )["data"]
+        food = nutrition.catalog.get_by_id(scan["id"])
+        expect(food["calories_for_3x"] == scan["calories"], "scan isn't the catalog's")
+
+        try:
+            await nutrition.predict_food(
+                io.BytesIO(b"not a photo"), "image/jpeg", user_id=USER_ID, keep=True
+            )
+        except HTTPException:
+            pass
+        count = (await nutrition.get_count_photo_today(USER_ID))["data"]["count"]
+        expect(count == used + 1, f"{count - used} uploads counted for 1")
+
+        # signups get distinct ML ids, a block of them per transaction
+        commits = calls["commit"]
+        await asyncio.gather(
+            *(db.init_user_detail(f"{USER_ID}-{i}") for i in range(SIGNUPS))
+        )
+        ml_ids = {
+            self.config.firestore.documents["user_detail"][f"{USER_ID}-{i}"]["ml_id"]
+            for i in range(SIGNUPS)
+        }
+        expect(len(ml_ids) == SIGNUPS, "two signups got the same ML id")
+        expect(
+            calls["commit"] - commits <= math.ceil(SIGNUPS / ML_ID_BLOCK_SIZE),
+            "ML ids are reserved more than a block at a time",
+        )
+
+    async def close(self):
+        await self.client.aclose()
+        await self.app.router.shutdown()
+
+    def service_cases(self) -> Dict[str, Case]:
+        auth = self.app.state.auth_service
+        nutrition = self.app.state.nutrition_service
+        settings = self.app.state.settings_service
+
+        return {
+            "auth.authenticate_user": lambda i: self.__scoped(
+                auth.authenticate_user(USER_EMAIL, USER_PASSWORD)
+            ),
+            "auth.refresh_token": lambda i: self.__scoped(
+                auth.refresh_token(self.refresh_token)
+            ),
+            "auth.who_am_i": lambda i: self.__scoped(auth.who_am_i(self.user)),
+            "auth.create_user": lambda i: self.__scoped(
+                auth.create_user(USER_NAME, f"bench{i}@example.com", USER_PASSWORD)
+            ),
+            "nutrition.predict_food[cached]": lambda i: self.__scoped(
+                nutrition.predict_food(
+                    io.BytesIO(self.photo), "image/jpeg", user_id=USER_ID
+                )
+            ),
+            "nutrition.predict_food[uncached]": lambda i: self.__scoped(
+                nutrition.predict_food(
+                    io.BytesIO(self.photos[i]), "image/jpeg", user_id=USER_ID
+                )
+            ),
+            "nutrition.predict_food[keep]": lambda i: self.__scoped(
+                nutrition.predict_food(
+                    io.BytesIO(self.photo), "image/jpeg", user_id=USER_ID, keep=True
+                )
+            ),
+            "nutrition.upload_nutrition_photo": lambda i: self.__scoped(
+                nutrition.upload_nutrition_photo(
+                    io.BytesIO(self.photo), USER_ID, "image/jpeg"
+                )
+            ),
+            "nutrition.get_recommendation_food": lambda i: self.__scoped(
+                nutrition.get_recommendation_food(USER_ID)
+            ),
+            "nutrition.search_foods": lambda i: self.__scoped(
+                nutrition.search_foods(
+                    ranges=["energi:100:300", "protein:10:"],
+                    kelompok_makanan=["Daging", "Ikan dsb"],
+                    sort="-protein",
+                )
+            ),
+            "nutrition.get_count_photo_today": lambda i: self.__scoped(
+                nutrition.get_count_photo_today(USER_ID)
+            ),
+            "settings.update_profile": lambda i: self.__scoped(
+                settings.update_profile(
+                    file=None, content_type="", **self.__profile_update()
+                )
+            ),
+            "settings.update_profile[photo]": lambda i: self.__scoped(
+                settings.update_profile(
+                    file=io.BytesIO(self.photo),
+                    content_type="image/jpeg",
+                    **self.__profile_update(),
+                )
+            ),
+            "settings.get_upload_nutrition_photo_history": lambda i: self.__scoped(
+                settings.get_upload_nutrition_photo_history(USER_ID)
+            ),
+        }
+
+    def route_cases(self) -> Dict[str, Case]:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        photo = lambda data: {"file": ("photo.jpg", data, "image/jpeg")}
+
+        return {
+            "GET /": lambda i: self.__call("GET", "/"),
+            "POST /auth/signin": lambda i: self.__call(
+                "POST",
+                "/auth/signin",
+                json={"email": USER_EMAIL, "password": USER_PASSWORD},
+            ),
+            "PUT /auth/refresh": lambda i: self.__call(
+                "PUT", "/auth/refresh", json={"refresh_token": self.refresh_token}
+            ),
+            "GET /auth/me": lambda i: self.__call("GET", "/auth/me", headers=headers),
+            "POST /nutrition/photo/predict_food_secure": lambda i: self.__call(
+                "POST",
+                "/nutrition/photo/predict_food_secure",
+                headers=headers,
+                files=photo(self.photo),
+            ),
+            "POST /nutrition/photo": lambda i: self.__call(
+                "POST", "/nutrition/photo", headers=headers, files=photo(self.photo)
+            ),
+            "GET /nutrition/recommendation": lambda i: self.__call(
+                "GET", "/nutrition/recommendation", headers=headers
+            ),
+            "GET /nutrition/foods": lambda i: self.__call(
+                "GET",
+                "/nutrition/foods?range=energi:100:300&range=protein:10:"
+                "&kelompok_makanan=Daging&kelompok_makanan=Ikan%20dsb&sort=-protein",
+                headers=headers,
+            ),
+            "GET /nutrition/photo/count": lambda i: self.__call(
+                "GET", "/nutrition/photo/count", headers=headers
+            ),
+            "GET /settings/nutrition-photo/all": lambda i: self.__call(
+                "GET", "/settings/nutrition-photo/all", headers=headers
+            ),
+            "PATCH /settings/profile/update": lambda i: self.__call(
+                "PATCH",
+                "/settings/profile/update",
+                headers=headers,
+                data=self.__profile_form(),
+            ),
+        }
+
+    def __profile_update(self) -> Dict:
+        return {
+            "name": USER_NAME,
+            "user": self.user,
+            "weight": 60,
+            "height": 170,
+            "sex": "M",
+            "calories_target": 2000,
+            "age": 25,
+            "eat_per_day": 3,
+            "refresh_token": self.refresh_token,
+        }
+
+    def __profile_form(self) -> Dict:
+        form = self.__profile_update()
+        del form["user"]
+        return {key: str(value) for key, value in form.items()}
+
+    async def __scoped(self, call: Awaitable[Dict]) -> Dict:
+        # the same per-request scope the middleware opens for a route
+        with self.config.firestore_app.request_scope():
+            result = await call
+
+        if result["code"] >= 300:
+            raise RuntimeError(f"unexpected result: {result}")
+
+        return result
+
+    async def __call(self, method: str, url: str, **kwargs) -> httpx.Response:
+        response = await self.client.request(method, url, **kwargs)
+
+        if response.status_code >= 300:
+            raise RuntimeError(
+                f"{method} {url} returned {response.status_code}: {response.text}"
+            )
+
+        return response
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+async def measure(case: Case, iterations: int, warmup: int, concurrency: int) -> Dict:
+    for i in range(warmup):
+        await case(i)
+
+    samples = []
+    indexes = iter(range(warmup, warmup + iterations))
+
+    async def worker():
+        for i in indexes:
+            start = time.perf_counter()
+            await case(i)
+            samples.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "iterations": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "min_ms": min(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+        "ops_per_sec": len(samples) / elapsed,
+    }
+
+
+async def run(
+    iterations: int,
+    warmup: int = 5,
+    concurrency: int = 1,
+    latency: float = 0.0,
+    ml_latency: Optional[float] = None,
+    only: Optional[str] = None,
+    trace_file: Optional[str] = None,
+) -> Dict:
+    config = FakeConfig(latency=latency, ml_latency=ml_latency, trace_file=trace_file)
+
+    with config.auth.install():
+        bench = Bench(config, photos=warmup + iterations)
+        await bench.setup()
+        await bench.verify()
+
+        cases = {
+            f"service {name}": case for name, case in bench.service_cases().items()
+        }
+        cases.update(
+            {f"route {name}": case for name, case in bench.route_cases().items()}
+        )
+
+        results = {}
+        try:
+            for name, case in cases.items():
+                if only is not None and only not in name:
+                    continue
+
+                stats = await measure(case, iterations, warmup, concurrency)
+                results[name] = stats
+                print(
+                    f"{name:<55} p50 {stats['p50_ms']:8.2f} ms"
+                    f"  p95 {stats['p95_ms']:8.2f} ms"
+                    f"  {stats['ops_per_sec']:8.1f} ops/s"
+                )
+        finally:
+            await bench.close()
+
+    return {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {
+            "iterations": iterations,
+            "warmup": warmup,
+            "concurrency": concurrency,
+            "latency_ms": latency * 1000,
+            "ml_latency_ms": (latency if ml_latency is None else ml_latency) * 1000,
+        },
+        "results": results,
+    }
+
+
+# Cases whose p50 grew by more than `max_regression` (0.2 = 20%) over the
+# baseline. Cases missing from either run are skipped.
+def compare(current: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    regressions = []
+
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or base["p50_ms"] <= 0:
+            continue
+
+        ratio = stats["p50_ms"] / base["p50_ms"]
+        if ratio > 1 + max_regression:
+            regressions.append(
+                f"{name}: p50 {base['p50_ms']:.2f} ms -> {stats['p50_ms']:.2f} ms"
+                f" (+{(ratio - 1) * 100:.0f}%)"
+            )
+
+    return regressions
@@ -1,26 +1,78 @@
 import os
+from typing import Any
 
 import firebase_admin
 from dotenv import dotenv_values
-from firebase_admin import credentials, firestore
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import credentials, firestore_async
 from google.cloud import storage
 from google.oauth2 import service_account
 
+from service.foods import FOOD_CSV
 from service.gcp.firestore import Firestore
+from service.gcp.identity import (
+    IDENTITY_TOOLKIT_URL,
+    SECURE_TOKEN_URL,
+    IdentityToolkit,
+)
 from service.gcp.storage import Storage
-from service.machine_learning.app import MLPredictions
-
-
+from service.image import DEFAULT_FORMAT, DEFAULT_MAX_PHOTO_BYTES, DEFAULT_MAX_SIDE
+from service.jobs import DEFAULT_MAX_QUEUED, DEFAULT_WORKERS
+from service.machine_learning.app import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_TIMEOUT_SECONDS,
+    MLPredictions,
+)
+from service.quota import DEFAULT_DAILY_LIMIT
+
+
+# Config only reads settings and wires the wrappers together. Nothing here
+# touches the network: the clients are created by the start_* coroutines
+# that server.create_app runs concurrently at startup.
 class Config:
     def __init__(self):
         self.api_key = get_api_key()
-        self.firebase_app = get_firebase_instance()
+        # both base urls can point at a local stub in tests and benchmarks
+        self.identity = IdentityToolkit(
+            api_key=self.api_key,
+            identity_toolkit_url=get_env("IDENTITY_TOOLKIT_URL", IDENTITY_TOOLKIT_URL),
+            secure_token_url=get_env("SECURE_TOKEN_URL", SECURE_TOKEN_URL),
+        )
+        # the default app, firebase_admin.auth falls back to it when None
+        self.firebase_app = None
         self.project_id = get_project_id()
-        self.gcs_app = get_gcs(self.project_id)
         self.bucket_name = get_bucket_name()
-        self.storage = Storage(client=self.gcs_app, bucket_name=self.bucket_name)
-        self.firestore_app = get_firestore(self.firebase_app)
+        self.max_photo_bytes = int(get_env("MAX_PHOTO_BYTES", DEFAULT_MAX_PHOTO_BYTES))
+        self.storage = Storage(
+            connect=lambda: get_gcs(self.project_id),
+            bucket_name=self.bucket_name,
+            max_upload_bytes=self.max_photo_bytes,
+        )
+        self.firestore_app = Firestore(connect=get_firestore_client)
         self.ml = get_machine_learning_instance()
+        # optional, predictions are only kept in memory when unset
+        self.prediction_cache_dir = get_env("PREDICTION_CACHE_DIR", None)
+        self.image_max_side = int(get_env("IMAGE_MAX_SIDE", DEFAULT_MAX_SIDE))
+        self.image_format = get_env("IMAGE_FORMAT", DEFAULT_FORMAT).upper()
+        # defaults to one process per CPU
+        image_workers = get_env("IMAGE_WORKERS", None)
+        self.image_workers = int(image_workers) if image_workers else None
+        self.daily_quota_limit = int(get_env("DAILY_QUOTA_LIMIT", DEFAULT_DAILY_LIMIT))
+        # tracing is off unless a file to append the traces to is set
+        self.trace_file = get_env("TRACE_FILE", None)
+        self.trace_min_duration_ms = float(get_env("TRACE_MIN_DURATION_MS", 0))
+        self.food_csv = get_env("FOOD_CSV", FOOD_CSV)
+        # recommendations are generated in the background after a profile edit
+        self.recommendation_workers = int(
+            get_env("RECOMMENDATION_WORKERS", DEFAULT_WORKERS)
+        )
+        self.max_queued_recommendations = int(
+            get_env("MAX_QUEUED_RECOMMENDATIONS", DEFAULT_MAX_QUEUED)
+        )
+
+    async def start_firebase(self):
+        if self.firebase_app is None:
+            self.firebase_app = await run_in_threadpool(get_firebase_instance)
 
 
 def get_api_key() -> str:
@@ -92,19 +144,21 @@ def get_gcs(project_id: str) -> storage.Client:
     return client
 
 
-def get_firestore(firebase_app):
-    client = firestore.client(app=firebase_app)
-    return Firestore(db=client)
+def get_firestore_client():
+    # needs the default app from get_firebase_instance
+    return firestore_async.client(app=firebase_admin.get_app())
 
 
 def get_machine_learning_instance() -> MLPredictions:
     try:
         food_predict_url = os.getenv("FOOD_PREDICTIONS_API")
-        food_recommendation_url = os.getenv("FOOD_PREDICTIONS_API")
-        if food_predict_url is not None and food_recommendation_url is not None:
+        if food_predict_url is not None:
             ml = MLPredictions(
                 food_prediction_api=food_predict_url,
-                food_recomendation_api=food_recommendation_url,
+                max_concurrency=int(
+                    get_env("ML_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+                ),
+                timeout=float(get_env("ML_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)),
             )
             return ml
 
@@ -113,11 +167,13 @@ def get_machine_learning_instance() -> MLPredictions:
     except ValueError:
         env = dotenv_values(".env")
         food_predict_url = env["FOOD_PREDICTIONS_API"]
-        food_recommendation_url = env["FOOD_PREDICTIONS_API"]
-        if food_predict_url is not None and food_recommendation_url is not None:
+        if food_predict_url is not None:
             ml = MLPredictions(
                 food_prediction_api=food_predict_url,
-                food_recomendation_api=food_recommendation_url,
+                max_concurrency=int(
+                    get_env("ML_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+                ),
+                timeout=float(get_env("ML_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)),
             )
             return ml
 
@@ -126,3 +182,11 @@ def get_machine_learning_instance() -> MLPredictions:
     except Exception:
         print("Machine Learning Instance creds is empty.")
         exit(1)
+
+
+def get_env(key: str, default: Any) -> Any:
+    value = os.getenv(key)
+    if value is not None:
+        return value
+
+    return dotenv_values(".env").get(key) or default
@@ -1,9 +1,17 @@
+import time
 from collections import defaultdict
+from typing import Callable, ContextManager
 
 from fastapi import FastAPI, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException, RequestValidationError
 from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from service import tracing
+from service.metrics import REQUEST_LATENCY, REQUESTS
+from service.readiness import Readiness
 
 
 def validation_body_exception_handler(app: FastAPI) -> callable:
@@ -69,3 +77,209 @@ def http_customize_handler(app: FastAPI) -> callable:
         return JSONResponse(status_code=exc.status_code, content=jsonable_encoder(resp))
 
     return http_exception_handler
+
+
+class RequestSizeLimitMiddleware:
+    # Plain ASGI middleware, so it sees the body while it arrives: a declared
+    # Content-Length is checked before anything is read, and every body,
+    # chunked ones included, is counted as it is received.
+    def __init__(self, app: ASGIApp, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > self.max_bytes:
+                # rejected before the body is read and spooled
+                await self.__reject(scope, receive, send)
+                return
+
+        received = 0
+        started = False
+        rejected = False
+
+        async def receive_limited() -> Message:
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+
+            message = await receive()
+            if message["type"] != "http.request" or started:
+                return message
+
+            received += len(message.get("body", b""))
+            if received > self.max_bytes:
+                # answer now, and let the app see a client that went away
+                rejected = True
+                await self.__reject(scope, receive, send)
+                return {"type": "http.disconnect"}
+
+            return message
+
+        async def send_started(message: Message):
+            nonlocal started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_started)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def __reject(self, scope: Scope, receive: Receive, send: Send):
+        resp = {"code": 413, "msg": "Request body is too large"}
+        await JSONResponse(status_code=413, content=resp)(scope, receive, send)
+
+
+def request_size_limit_handler(app: FastAPI, max_bytes: int):
+    # multipart framing around the photo and the other form fields
+    overhead = 64 * 1024
+
+    app.add_middleware(RequestSizeLimitMiddleware, max_bytes=max_bytes + overhead)
+
+
+def _route_template(scope: Scope) -> str:
+    # the route template keeps the label set small, unlike the raw path; the
+    # router puts the matched route in the scope on the way in
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            method, template = scope["method"], _route_template(scope)
+            REQUEST_LATENCY.labels(method, template).observe(
+                time.perf_counter() - start
+            )
+            REQUESTS.labels(method, template, str(status)).inc()
+
+
+def request_metrics_handler(app: FastAPI):
+    # register last so it wraps the other middlewares and sees every response
+    app.add_middleware(RequestMetricsMiddleware)
+
+
+class RequestTracingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        with tracing.span(
+            method,
+            kind=tracing.SERVER,
+            traceparent=Headers(scope=scope).get("traceparent"),
+        ) as span:
+            if span is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_status(message: Message):
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    span.set_attribute("http.status_code", status)
+                    if status >= 500:
+                        span.set_error(f"HTTP {status}")
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_status)
+            finally:
+                template = _route_template(scope)
+                span.name = f"{method} {template}"
+                span.set_attribute("http.method", method)
+                span.set_attribute("http.route", template)
+
+
+def request_tracing_handler(app: FastAPI):
+    app.add_middleware(RequestTracingMiddleware)
+
+
+class ReadinessGateMiddleware:
+    # Requests that arrive while the dependencies are still starting wait for
+    # them instead of reaching a half-initialised service.
+    def __init__(
+        self, app: ASGIApp, readiness: Readiness, max_wait: float, open_paths: set
+    ):
+        self.app = app
+        self.readiness = readiness
+        self.max_wait = max_wait
+        self.open_paths = open_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] == "http"
+            and not self.readiness.ready
+            and scope["path"] not in self.open_paths
+        ):
+            if not await self.readiness.wait(self.max_wait):
+                resp = {"code": 503, "msg": "Service is starting. Try again later"}
+                response = JSONResponse(
+                    status_code=503, content=resp, headers={"Retry-After": "5"}
+                )
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+
+def readiness_gate_handler(
+    app: FastAPI, readiness: Readiness, max_wait: float, open_paths: set
+):
+    app.add_middleware(
+        ReadinessGateMiddleware,
+        readiness=readiness,
+        max_wait=max_wait,
+        open_paths=open_paths,
+    )
+
+
+class RequestScopeMiddleware:
+    # Runs every request inside the context manager `request_scope` returns.
+    def __init__(self, app: ASGIApp, request_scope: Callable[[], ContextManager]):
+        self.app = app
+        self.request_scope = request_scope
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with self.request_scope():
+            await self.app(scope, receive, send)
+
+
+def request_scope_handler(app: FastAPI, request_scope: Callable[[], ContextManager]):
+    app.add_middleware(RequestScopeMiddleware, request_scope=request_scope)
@@ -23,7 +23,7 @@ def routes(service: AuthService) -> APIRouter:
         }
         ```
         """
-        result = service.create_user(body.name, body.email, body.password)
+        result = await service.create_user(body.name, body.email, body.password)
         return JSONResponse(status_code=result["code"], content=result)
 
     @router.post("/signin", status_code=200)
@@ -47,7 +47,7 @@ def routes(service: AuthService) -> APIRouter:
         }
         ```
         """
-        result = service.authenticate_user(body.email, body.password)
+        result = await service.authenticate_user(body.email, body.password)
         return JSONResponse(status_code=result["code"], content=result)
 
     @router.post("/signout", status_code=200)
@@ -64,7 +64,7 @@ def routes(service: AuthService) -> APIRouter:
         }
         ```
         """
-        result = service.revoke_token(user.user_id)
+        result = await service.revoke_token(user.user_id)
         return JSONResponse(status_code=result["code"], content=result)
 
     @router.put("/refresh", status_code=200)
@@ -87,7 +87,7 @@ def routes(service: AuthService) -> APIRouter:
         }
         ```
         """
-        result = service.refresh_token(body.refresh_token)
+        result = await service.refresh_token(body.refresh_token)
         return JSONResponse(status_code=result["code"], content=result)
 
     @router.get("/me", status_code=200)
@@ -111,7 +111,7 @@ def routes(service: AuthService) -> APIRouter:
         ```
         """
 
-        result = service.who_am_i(user)
+        result = await service.who_am_i(user)
 
         return JSONResponse(status_code=result["code"], content=result)
 
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, UploadFile
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query, UploadFile
 from fastapi.responses import JSONResponse
 
 from service.nutrition import NutritionService
 
+from .photo import check_photo
 from .security import User, extract_token
 
 
@@ -15,13 +18,28 @@ def routes(service: NutritionService) -> APIRouter:
     ) -> JSONResponse:
         """
         Get user recommendation food.\n
-        If still generating? Response 423 will be thrown.\n
+        Built from the nutrients of every food and the user's profile (calories target, eat times per day, sex and age).\n
+        Generated in the background after the profile changes. Until it's ready, response 202 says how the job is doing, ask again after `retry_after` seconds (also in the Retry-After header).\n
+        If the profile hasn't been filled yet? Response 400 will be thrown.\n
+
+        Response: 202
+        ```
+        {
+            "code": 202,
+            "msg": "Still generating. Please wait",
+            "data": {
+                "status": "queued", // or "running"
+                "queued_at": "2023-06-07 12:15:31",
+                "retry_after": 1
+            }
+        }
+        ```
 
-        Response: 423
+        Response: 400
         ```
         {
-            "code": 423,
-            "msg": "Still generating. Please wait"
+            "code": 400,
+            "msg": "Can't generate recommendation. Please fill the data first in the profile."
         }
         ```
 
@@ -171,7 +189,85 @@ def routes(service: NutritionService) -> APIRouter:
         ```
         """
 
-        result = service.get_recommendation_food(user.user_id)
+        result = await service.get_recommendation_food(user.user_id)
+
+        headers = None
+        if result["code"] == 202:
+            headers = {"Retry-After": str(result["data"]["retry_after"])}
+
+        return JSONResponse(status_code=result["code"], content=result, headers=headers)
+
+    @router.get("/foods")
+    async def search_foods(
+        user: User = Depends(extract_token),
+        ranges: Optional[List[str]] = Query(default=None, alias="range"),
+        kelompok_makanan: Optional[List[str]] = Query(default=None),
+        jenis_olahan: Optional[List[str]] = Query(default=None),
+        fast_food: Optional[bool] = None,
+        sort: str = "name",
+        page: int = Query(default=1, ge=1),
+        page_size: int = Query(default=20, ge=1, le=100),
+    ) -> JSONResponse:
+        """
+        Search the foods by their nutrients (per 100 g) and categories. \n
+        `range` is `nutrient:min:max`, both inclusive and either may be left empty. Repeat it to filter on more nutrients. \n
+        `kelompok_makanan` and `jenis_olahan` can be repeated too, a food matches any of them. \n
+        `sort` is `name` or a nutrient, prefix it with `-` for the highest first. \n
+        Nutrients: air, energi, protein, lemak, karbohidrat, serat, abu, kalsium, fosfor, besi, natrium, kalium, tembaga, seng, retinol, beta_karoten, karoten_total, thiamin, riboflavin, niasin, vitamin_c, bdd \n
+        **Example:** https://pier.solo.md/nutrition/foods?range=energi:100:300&range=protein:10:&kelompok_makanan=Daging&sort=-protein (meat dishes of 100 to 300 kcal with at least 10 g protein, most protein first) \n
+        **NOTE:** Requires a Bearer Token \n
+
+        Response: 200
+        ```
+        {
+            "code": 200,
+            "msg": "OK",
+            "data": {
+                "foods": [
+                    {
+                        "id": "FNT069",
+                        "name": "Ikan asin kering",
+                        "fast_food": "Tidak",
+                        "tipe": "Makanan Berat",
+                        "jenis_olahan": "Mentah",
+                        "mentah_olahan": "Olahan",
+                        "kelompok_makanan": "Ikan dsb",
+                        "nutrients": {
+                            "air": 40.0,
+                            "energi": 193.0,
+                            "protein": 42.0,
+                            // every nutrient
+                        }
+                    },
+                    //until page_size data
+                ],
+                "total": 30,
+                "page": 1,
+                "page_size": 20
+            }
+        }
+        ```
+
+        Response: 422
+        ```
+        {
+            "code": 422,
+            "msg": "Unprocessable Entity",
+            "errors": {
+                "range": "Unknown nutrient gula"
+            }
+        }
+        ```
+        """
+        result = await service.search_foods(
+            ranges=ranges,
+            kelompok_makanan=kelompok_makanan,
+            jenis_olahan=jenis_olahan,
+            fast_food=fast_food,
+            sort=sort,
+            page=page,
+            page_size=page_size,
+        )
         return JSONResponse(status_code=result["code"], content=result)
 
     @router.post("/photo")
@@ -197,7 +293,8 @@ def routes(service: NutritionService) -> APIRouter:
         }
         ```
         """
-        result = service.upload_nutrition_photo(
+        await check_photo(file, service.storage.max_upload_bytes)
+        result = await service.upload_nutrition_photo(
             file=file.file, user_id=user.user_id, content_type=file.content_type
         )
         return JSONResponse(status_code=result["code"], content=result)
@@ -225,12 +322,15 @@ def routes(service: NutritionService) -> APIRouter:
         }
         ```
         """
-        result = service.predict_food(file=file.file, content_type=file.content_type)
+        await check_photo(file, service.storage.max_upload_bytes)
+        result = await service.predict_food(
+            file=file.file, content_type=file.content_type
+        )
         return JSONResponse(status_code=result["code"], content=result)
 
     @router.post("/photo/predict_food_secure")
     async def predict_food_photo_secure(
-        file: UploadFile, user: User = Depends(extract_token)
+        file: UploadFile, keep: bool = False, user: User = Depends(extract_token)
     ) -> JSONResponse:
         """
         📑 _API security is like giving your sensitive data to a toddler and hoping they won't accidentally share it with the world. - Anonymous_ \n
@@ -240,6 +340,10 @@ def routes(service: NutritionService) -> APIRouter:
         1. final_result: we are very confident this is the result\n
         2. other_options: other 2 results, that maybe also the result\n
 
+        The photo is not stored by default. Send `?keep=true` to save it to the
+        user's nutrition history too, the saved entry is returned as `saved`.
+        A kept scan counts as an upload too (see `/nutrition/photo/count`).\n
+
         Response: 200
         ```
         {
@@ -248,13 +352,50 @@ def routes(service: NutritionService) -> APIRouter:
             "data": {
                 "id": "FNT004",
                 "name": "Sate",
-                "calories": 607
+                "calories": 607,
+                "other_options": [
+                    {
+                        "id": "FNT001",
+                        "name": "Bakso",
+                        "calories": 545
+                    }
+                ]
+            }
+        }
+        ```
+
+        Response: 404 (the predicted food isn't in the catalog)
+        ```
+        {
+            "code": 404,
+            "msg": "The food is not in our catalog yet"
+        }
+        ```
+
+        Response: 200 (with `keep=true`)
+        ```
+        {
+            "code": 200,
+            "msg": "OK",
+            "data": {
+                "id": "FNT004",
+                "name": "Sate",
+                "calories": 607,
+                "saved": {
+                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
+                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
+                    "created_at": "2023-06-07 19:15:31"
+                }
             }
         }
         ```
         """
-        result = service.predict_food(
-            file=file.file, content_type=file.content_type, user_id=user.user_id
+        await check_photo(file, service.storage.max_upload_bytes)
+        result = await service.predict_food(
+            file=file.file,
+            content_type=file.content_type,
+            user_id=user.user_id,
+            keep=keep,
         )
         return JSONResponse(status_code=result["code"], content=result)
 
@@ -276,7 +417,7 @@ def routes(service: NutritionService) -> APIRouter:
         }
         ```
         """
-        result = service.get_count_photo_today(user_id=user.user_id)
+        result = await service.get_count_photo_today(user_id=user.user_id)
         return JSONResponse(status_code=result["code"], content=result)
 
     return router
@@ -0,0 +1,16 @@
+from fastapi import HTTPException, UploadFile
+
+from service.image import SNIFF_BYTES, sniff_content_type
+
+
+async def check_photo(file: UploadFile, max_bytes: int):
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+
+    head = await file.read(SNIFF_BYTES)
+    await file.seek(0)
+
+    if sniff_content_type(head) is None:
+        raise HTTPException(
+            status_code=415, detail="Only JPEG, PNG or WebP photos are allowed"
+        )
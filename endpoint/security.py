@@ -1,13 +1,25 @@
+import hashlib
+
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from firebase_admin import auth
 from firebase_admin._auth_utils import InvalidIdTokenError
 from firebase_admin._token_gen import ExpiredIdTokenError
 
+from service.cache import LRUCache
+from service.metrics import register_cache
+
 security = HTTPBearer(
     description="Bearer token", scheme_name="Place your bearer token here"
 )
 
+TOKEN_CACHE_SIZE = 10_000
+
+# verified users keyed by sha256(token), each entry expires at the token's exp
+token_cache = LRUCache(max_size=TOKEN_CACHE_SIZE)
+register_cache("token", token_cache.stats)
+
 
 class User:
     def __init__(
@@ -20,14 +32,21 @@ class User:
         self.auth_token = auth_token
 
 
-def extract_token(token: HTTPAuthorizationCredentials = Depends(security)) -> User:
+async def extract_token(
+    token: HTTPAuthorizationCredentials = Depends(security),
+) -> User:
     if token.scheme != "Bearer":
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     id_token = token.credentials
+    cache_key = hashlib.sha256(id_token.encode()).hexdigest()
+
+    cached_user = token_cache.get(cache_key)
+    if cached_user is not None:
+        return cached_user
 
     try:
-        credentials = auth.verify_id_token(id_token)
+        credentials = await run_in_threadpool(auth.verify_id_token, id_token)
         user = User(
             id_user=credentials["user_id"],
             name=credentials["name"],
@@ -36,6 +55,8 @@ def extract_token(token: HTTPAuthorizationCredentials = Depends(security)) -> Us
             auth_token=id_token,
         )
 
+        token_cache.set(cache_key, user, expires_at=credentials["exp"])
+
         return user
 
     except ExpiredIdTokenError:
@@ -1,10 +1,11 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, File, Form, UploadFile
+from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from fastapi.responses import JSONResponse
 
 from service.settings import SettingsService
 
+from .photo import check_photo
 from .security import User, extract_token
 
 
@@ -56,7 +57,8 @@ def routes(service: SettingsService) -> APIRouter:
         ```
         """
         if img is not None:
-            result = service.update_profile(
+            await check_photo(img, service.storage.max_upload_bytes)
+            result = await service.update_profile(
                 name=name,
                 file=img.file,
                 content_type=img.content_type,
@@ -71,7 +73,7 @@ def routes(service: SettingsService) -> APIRouter:
             )
             return JSONResponse(status_code=result["code"], content=result)
 
-        result = service.update_profile(
+        result = await service.update_profile(
             user=user,
             name=name,
             file=None,
@@ -88,12 +90,16 @@ def routes(service: SettingsService) -> APIRouter:
 
     @router.get("/nutrition-photo/all")
     async def get_all_photo_nutrition(
-        user: User = Depends(extract_token), page: int = 0
+        user: User = Depends(extract_token),
+        cursor: Optional[str] = None,
+        page_size: int = Query(default=10, ge=1, le=50),
     ):
         """
-        Get all the user nutrition photo. \n
-        This page will be paginated (means, only first 10 will be given to you, bastard). \n
-        **Example:** https://pier.solo.md/settings/nutrition-photo/all?page=0 (fetch first 10 latest photo) \n
+        Get all the user nutrition photo, latest first. \n
+        This page will be paginated (means, only first `page_size` will be given to you, bastard, max 50). \n
+        Pass the `next_cursor` of a response as `cursor` to get the next page. `next_cursor` is null on the last page. \n
+        **Example:** https://pier.solo.md/settings/nutrition-photo/all (fetch first 10 latest photo) \n
+        **Example:** https://pier.solo.md/settings/nutrition-photo/all?cursor=WyIyMDIzLTA2LTA3VDEyOjE2OjMxKzAwOjAwIiwgImNmUTMyeUh4R3JzTHRVSkVkdEdvIl0 (fetch the next 10) \n
         **NOTE:** Requires a Bearer Token \n
 
         Response: 200
@@ -101,49 +107,38 @@ def routes(service: SettingsService) -> APIRouter:
         {
             "code": 200,
             "msg": "OK",
-            "data": [
-                {
-                    "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
-                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
-                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
-                    "created_at": "2023-06-07 19:16:31"
-                },
-                {
-                    "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
-                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
-                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
-                    "created_at": "2023-06-07 19:18:31"
-                },
-                {
-                    "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
-                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
-                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
-                    "created_at": "2023-06-07 19:16:31"
-                },
-                {
-                    "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
-                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
-                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
-                    "created_at": "2023-06-07 19:18:31"
-                },
-                {
-                    "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
-                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
-                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
-                    "created_at": "2023-06-07 19:16:31"
-                },
-                {
-                    "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
-                    "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
-                    "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
-                    "created_at": "2023-06-07 19:18:31"
-                }
-            ]
+            "data": {
+                "photos": [
+                    {
+                        "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
+                        "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
+                        "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
+                        "created_at": "2023-06-07 19:18:31"
+                    },
+                    {
+                        "nutrition_id": "cfQ32yHxGrsLtUJEdtGo",
+                        "img_url": "https://storage.googleapis.com/nusa-bucket/lrGpw03KXZTy7ZW9Um2OO1Bxxr72/nutrition/QRe65L5QFTc8mafSGmPJeb",
+                        "user_id": "lrGpw03KXZTy7ZW9Um2OO1Bxxr72",
+                        "created_at": "2023-06-07 19:16:31"
+                    }
+                ],
+                "next_cursor": "WyIyMDIzLTA2LTA3VDEyOjE2OjMxKzAwOjAwIiwgImNmUTMyeUh4R3JzTHRVSkVkdEdvIl0"
+            }
+        }
+        ```
+
+        Response: 400
+        ```
+        {
+            "code": 400,
+            "msg": "Invalid cursor"
         }
         ```
         """
         user_id = user.user_id
-        result = service.get_upload_nutrition_photo_history(user_id=user_id, page=page)
+        result = await service.get_upload_nutrition_photo_history(
+            user_id=user_id, cursor=cursor, page_size=page_size
+        )
         return JSONResponse(status_code=result["code"], content=result)
 
     return router
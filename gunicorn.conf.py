@@ -0,0 +1,30 @@
+# gunicorn -c gunicorn.conf.py main:app
+#
+# The app is imported once in the master (preload_app) and the workers are
+# forked from it, so the settings and the food catalog are loaded once and
+# shared copy-on-write. Nothing imported before the fork opens a connection:
+# Firebase, Firestore, Cloud Storage, the httpx clients of the prediction
+# Space and the identity endpoints, and the image process pool are created in
+# each worker, by the startup event or on first use. So no post_fork setup is
+# needed.
+import multiprocessing
+import os
+import shutil
+
+bind = f":{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# must exist before prometheus_client is imported by the app
+prometheus_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if prometheus_dir:
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir)
+
+
+def child_exit(server, worker):
+    if prometheus_dir:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,17 @@
-import csv
+import argparse
+from concurrent import futures
+from typing import Dict, List, Optional
 
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from service.foods import FOOD_CSV, iter_food_documents
+
+COLLECTION = "food_collection"
+# Firestore refuses a batch of more than 500 writes
+MAX_BATCH_SIZE = 500
+DEFAULT_PARALLEL_COMMITS = 4
+
 
 def get_firebase_instance():
     cred = credentials.Certificate("serviceAccountKey.json")
@@ -15,48 +24,137 @@ def get_firestore(firebase_app):
     return firestore.client(app=firebase_app)
 
 
+def changed_fields(current: Optional[Dict], document: Dict) -> List[str]:
+    # Only the fields the CSV provides are compared, and merged on write,
+    # so fields added to a document by hand (e.g. img) are kept.
+    if current is None:
+        return list(document)
+
+    return [key for key, value in document.items() if current.get(key) != value]
+
+
+def load(
+    db,
+    path: str = FOOD_CSV,
+    dry_run: bool = False,
+    batch_size: int = MAX_BATCH_SIZE,
+    parallel: int = DEFAULT_PARALLEL_COMMITS,
+) -> Dict:
+    """
+    Brings `food_collection` in line with the CSV at `path`.
+
+    The collection is read once, then the CSV is streamed and diffed
+    against it row by row. Only new or changed documents are written, in
+    batches of `batch_size`, with up to `parallel` batches committing at
+    once. Running it again without changes to the CSV writes nothing.
+    """
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    collection_ref = db.collection(COLLECTION)
+    current = {doc.id: doc.to_dict() for doc in collection_ref.stream()}
+
+    report = {"created": [], "updated": {}, "unchanged": 0, "not_in_csv": []}
+    seen = set()
+
+    with futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        committing = set()
+        batch, size = db.batch(), 0
+
+        for document in iter_food_documents(path):
+            name = document["name"]
+            seen.add(name)
+
+            fields = changed_fields(current.get(name), document)
+            if not fields:
+                report["unchanged"] += 1
+                continue
+
+            if name in current:
+                report["updated"][name] = fields
+            else:
+                report["created"].append(name)
+
+            if dry_run:
+                continue
+
+            batch.set(collection_ref.document(name), document, merge=True)
+            size += 1
+            if size < batch_size:
+                continue
+
+            committing.add(executor.submit(batch.commit))
+            batch, size = db.batch(), 0
+
+            # bounds the batches held in memory when the CSV is large
+            if len(committing) >= parallel:
+                done, committing = futures.wait(
+                    committing, return_when=futures.FIRST_COMPLETED
+                )
+                for commit in done:
+                    commit.result()
+
+        if size > 0:
+            committing.add(executor.submit(batch.commit))
+
+        for commit in futures.as_completed(committing):
+            commit.result()
+
+    report["not_in_csv"] = sorted(set(current) - seen)
+
+    return report
+
+
+def print_report(report: Dict, dry_run: bool):
+    verb = "would be" if dry_run else "were"
+
+    print(f"{len(report['created'])} foods {verb} created")
+    for name in report["created"]:
+        print(f"  + {name}")
+
+    print(f"{len(report['updated'])} foods {verb} updated")
+    for name, fields in report["updated"].items():
+        print(f"  ~ {name}: {', '.join(fields)}")
+
+    print(f"{report['unchanged']} foods are unchanged")
+
+    if report["not_in_csv"]:
+        print(f"{len(report['not_in_csv'])} foods are only in {COLLECTION}, kept:")
+        for name in report["not_in_csv"]:
+            print(f"  ? {name}")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Load the food CSV into the {COLLECTION} collection."
+    )
+    parser.add_argument("--csv", default=FOOD_CSV, help="file to load")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only report what would be written",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=MAX_BATCH_SIZE,
+        help=f"writes per batch, at most {MAX_BATCH_SIZE}",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=DEFAULT_PARALLEL_COMMITS,
+        help="batches committed at the same time",
+    )
+    args = parser.parse_args()
+
     db = get_firestore(get_firebase_instance())
 
-    collection_ref = db.collection("food_collection")
-
-    with open("food_raw.csv", "r") as f:
-        csvreader = csv.reader(f)
-
-        _ = next(csvreader)
-
-        for row in csvreader:
-            id, name, calories = row[1], row[2], int(row[8])
-            protein, lemak, karbohidrat = (
-                int(round(float(row[9]))),
-                int(round(float(row[10]))),
-                int(round(float(row[11]))),
-            )
-
-            # vitamin ganti serat
-            # mineral pake air
-
-            vitamin = int(round(float(row[12])))
-            mineral = int(round(float(row[7])))
-
-            table = collection_ref.document(name)
-
-            table.set(
-                {
-                    "id": id,
-                    "name": name,
-                    "calories": calories,
-                    "calories_for_2x": calories * 4,
-                    "calories_for_3x": int(calories * 2.7),
-                    "calories_for_4x": calories * 2,
-                    "protein": protein,
-                    "lemak": lemak,
-                    "karbohidrat": karbohidrat,
-                    "vitamin": vitamin,
-                    "mineral": mineral,
-                }
-            )
-
-    f.close()
+    report = load(
+        db,
+        path=args.csv,
+        dry_run=args.dry_run,
+        batch_size=args.batch_size,
+        parallel=args.parallel,
+    )
+    print_report(report, dry_run=args.dry_run)
 
     print("Job finished")
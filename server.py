@@ -0,0 +1,182 @@
+from typing import Any
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+import metadata
+from customizer import (
+    http_customize_handler,
+    readiness_gate_handler,
+    request_metrics_handler,
+    request_scope_handler,
+    request_size_limit_handler,
+    request_tracing_handler,
+    validation_body_exception_handler,
+)
+from endpoint.auth import routes as auth_routes
+from endpoint.nutrition import routes as nutrition_routes
+from endpoint.settings import routes as settings_routes
+from service import tracing
+from service.authentication import AuthService
+from service.catalog import FoodCatalog
+from service.food_table import FoodTable
+from service.foods import read_foods
+from service.image import ImageNormalizer
+from service.machine_learning.cache import PredictionCache
+from service.metrics import exposition
+from service.nutrition import NutritionService
+from service.quota import Quota
+from service.readiness import Readiness
+from service.recommendation import RecommendationEngine
+from service.settings import SettingsService
+
+# how long a request that arrives during startup waits for the dependencies
+READY_WAIT_SECONDS = 30.0
+
+# answered even while the dependencies are starting
+OPEN_PATHS = {"/", "/healthz/ready", "/_ah/warmup", "/metrics"}
+
+
+# `config` is anything shaped like config.Config, so the benchmarks can build
+# the same app on top of in-memory fakes.
+def create_app(config: Any) -> FastAPI:
+    tracing.configure(config.trace_file, config.trace_min_duration_ms)
+
+    food_catalog = FoodCatalog(db=config.firestore_app)
+    quota = Quota(db=config.firestore_app, limit=config.daily_quota_limit)
+    prediction_cache = PredictionCache(persist_dir=config.prediction_cache_dir)
+    normalizer = ImageNormalizer(
+        max_side=config.image_max_side,
+        format=config.image_format,
+        max_workers=config.image_workers,
+    )
+
+    # started concurrently, each one as soon as what it requires is ready
+    readiness = Readiness()
+    readiness.add("firebase", config.start_firebase)
+    readiness.add("firestore", config.firestore_app.start, requires=["firebase"])
+    readiness.add("storage", config.storage.start)
+    readiness.add("ml", config.ml.start)
+
+    # The catalog is static, seeding it here means it is loaded once in the
+    # gunicorn master with --preload and shared by every worker after fork.
+    # Firestore stays the source of truth: it is read as soon as it is up,
+    # for the foods and photos that are only kept there, and again after the
+    # TTL. Without a seed the instance has to wait for that first read.
+    try:
+        food_catalog.seed(read_foods(config.food_csv))
+        seeded = True
+    except (OSError, ValueError, IndexError) as e:
+        print("create_app: can't seed the food catalog:", e)
+        seeded = False
+    readiness.add(
+        "food_catalog", food_catalog.load, requires=["firestore"], optional=seeded
+    )
+
+    # the nutrient table only exists in the CSV, so it has to load
+    food_table = FoodTable.from_csv(config.food_csv)
+    recommender = RecommendationEngine(food_table)
+
+    # service
+    auth_service = AuthService(
+        app=config.firebase_app, identity=config.identity, db=config.firestore_app
+    )
+    nutrition_service = NutritionService(
+        app=config.firebase_app,
+        storage=config.storage,
+        db=config.firestore_app,
+        ml=config.ml,
+        catalog=food_catalog,
+        quota=quota,
+        prediction_cache=prediction_cache,
+        normalizer=normalizer,
+        food_table=food_table,
+        recommender=recommender,
+        recommendation_workers=config.recommendation_workers,
+        max_queued_recommendations=config.max_queued_recommendations,
+    )
+    settings_service = SettingsService(
+        app=config.firebase_app,
+        storage=config.storage,
+        db=config.firestore_app,
+        api_key=config.api_key,
+        auth_service=auth_service,
+        normalizer=normalizer,
+        nutrition_service=nutrition_service,
+    )
+
+    # router
+    app = FastAPI(
+        title=metadata.title,
+        description=metadata.description,
+        version=metadata.version,
+        contact=metadata.contact,
+        license_info=metadata.license_info,
+        openapi_tags=metadata.tags_metadata,
+        debug=True,
+    )
+
+    app.state.auth_service = auth_service
+    app.state.nutrition_service = nutrition_service
+    app.state.settings_service = settings_service
+    app.state.readiness = readiness
+
+    request_scope_handler(app, config.firestore_app.request_scope)
+    validation_body_exception_handler(app)
+    http_customize_handler(app)
+    request_size_limit_handler(app, config.max_photo_bytes)
+    readiness_gate_handler(app, readiness, READY_WAIT_SECONDS, OPEN_PATHS)
+    request_tracing_handler(app)
+    request_metrics_handler(app)
+
+    @app.on_event("startup")
+    async def start_dependencies():
+        readiness.start()
+        nutrition_service.recommendation_jobs.start()
+
+    @app.on_event("shutdown")
+    async def close_clients():
+        await readiness.stop()
+        await nutrition_service.recommendation_jobs.stop()
+        await config.ml.close()
+        await config.identity.close()
+        normalizer.shutdown()
+        tracing.shutdown()
+
+    app.include_router(auth_routes(auth_service))
+    app.include_router(nutrition_routes(nutrition_service))
+    app.include_router(settings_routes(settings_service))
+
+    @app.get("/")
+    async def index() -> JSONResponse:
+        return JSONResponse(status_code=200, content={"code": 200, "msg": "OK"})
+
+    @app.get("/healthz/ready", include_in_schema=False)
+    async def ready() -> JSONResponse:
+        report = readiness.report()
+        if not report["ready"]:
+            return JSONResponse(
+                status_code=503,
+                content={"code": 503, "msg": "Not ready", "data": report},
+            )
+
+        return JSONResponse(
+            status_code=200, content={"code": 200, "msg": "OK", "data": report}
+        )
+
+    # App Engine sends this before routing traffic to a new instance
+    @app.get("/_ah/warmup", include_in_schema=False)
+    async def warmup() -> JSONResponse:
+        if not await readiness.wait(READY_WAIT_SECONDS):
+            return JSONResponse(
+                status_code=503, content={"code": 503, "msg": "Not ready"}
+            )
+
+        return JSONResponse(status_code=200, content={"code": 200, "msg": "OK"})
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> Response:
+        return Response(content=exposition(), media_type=CONTENT_TYPE_LATEST)
+
+    return app
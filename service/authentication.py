@@ -1,28 +1,33 @@
 import json
 from typing import Any
 
-import requests
+import httpx
+from fastapi.concurrency import run_in_threadpool
 from firebase_admin import auth
 from firebase_admin._auth_utils import EmailAlreadyExistsError
 from firebase_admin.exceptions import FirebaseError
 
 from .gcp.firestore import Firestore
+from .gcp.identity import IdentityToolkit
 
 from collections import ChainMap
 from . import result
+from .tracing import traced
 
 DEFAULT_PHOTO_URL = "https://static.vecteezy.com/system/resources/thumbnails/004/511/281/small/default-avatar-photo-placeholder-profile-picture-vector.jpg"
 
 
 class AuthService:
-    def __init__(self, app: Any, api_key: str, db: Firestore):
+    def __init__(self, app: Any, identity: IdentityToolkit, db: Firestore):
         self.app = app
-        self.api_key = api_key
+        self.identity = identity
         self.db = db
 
-    def create_user(self, name: str, email: str, password: str) -> result.Result:
+    @traced
+    async def create_user(self, name: str, email: str, password: str) -> result.Result:
         try:
-            user = auth.create_user(
+            user = await run_in_threadpool(
+                auth.create_user,
                 app=self.app,
                 display_name=name,
                 email=email,
@@ -30,8 +35,7 @@ class AuthService:
                 password=password,
             )
 
-            self.db.init_user_detail(user.uid)
-            self.db.init_user_scan_count(user.uid)
+            await self.db.init_user_detail(user.uid)
 
             return result.Created()
 
@@ -49,19 +53,10 @@ class AuthService:
             print("AuthService.create_user:", e)
             return result.InternalErr()
 
-    def authenticate_user(self, email: str, password: str) -> result.Result:
-        request_ref = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={self.api_key}"
-        headers = {"content-type": "application/json; charset=UTF-8"}
-
-        data = json.dumps(
-            {"email": email, "password": password, "returnSecureToken": True}
-        )
-
+    @traced
+    async def authenticate_user(self, email: str, password: str) -> result.Result:
         try:
-            response = requests.post(request_ref, headers=headers, data=data)
-            response.raise_for_status()
-
-            obj = response.json()
+            obj = await self.identity.sign_in_with_password(email, password)
 
             resp = {
                 "id": obj["localId"],
@@ -72,11 +67,11 @@ class AuthService:
                 "expires_in": obj["expiresIn"],
             }
 
-            creds = self.db.get_user_detail(obj["localId"])
+            creds = await self.db.get_user_detail(obj["localId"])
             response = dict(ChainMap(resp, creds))
 
             return result.OK(response)
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             code = e.response.status_code
             txt = self._extract_response_text(e.response.text, "message")
             msg = self._get_error_msg_by_firebase_err(txt)
@@ -87,9 +82,12 @@ class AuthService:
             print("AuthService.authenticate_user:", e)
             return result.InternalErr()
 
-    def revoke_token(self, id_user: str) -> result.Result:
+    @traced
+    async def revoke_token(self, id_user: str) -> result.Result:
         try:
-            auth.revoke_refresh_tokens(uid=id_user, app=self.app)
+            await run_in_threadpool(
+                auth.revoke_refresh_tokens, uid=id_user, app=self.app
+            )
             return result.OK()
 
         except ValueError:
@@ -99,17 +97,10 @@ class AuthService:
             print("AuthService.revoke_token:", e)
             return result.InternalErr()
 
-    def refresh_token(self, refresh_token: str) -> result.Result:
-        request_ref = f"https://securetoken.googleapis.com/v1/token?key={self.api_key}"
-        headers = {"content-type": "application/json; charset=UTF-8"}
-
-        data = json.dumps({"grantType": "refresh_token", "refreshToken": refresh_token})
-
+    @traced
+    async def refresh_token(self, refresh_token: str) -> result.Result:
         try:
-            response = requests.post(request_ref, headers=headers, data=data)
-            response.raise_for_status()
-
-            obj = response.json()
+            obj = await self.identity.refresh_token(refresh_token)
 
             resp = {
                 "id": obj["user_id"],
@@ -120,7 +111,7 @@ class AuthService:
 
             return result.OK(resp)
 
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             code = e.response.status_code
             txt = self._extract_response_text(e.response.text, "message")
             msg = self._get_error_msg_by_firebase_err(txt)
@@ -131,8 +122,9 @@ class AuthService:
             print("AuthService.refresh_token:", e)
             return result.InternalErr()
 
-    def who_am_i(self, user):
-        creds = self.db.get_user_detail(user.user_id)
+    @traced
+    async def who_am_i(self, user):
+        creds = await self.db.get_user_detail(user.user_id)
         if creds is None:
             print("user is none")
             return result.InternalErr()
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+
+from .gcp.firestore import Firestore
+from .labels import LabelIndex
+
+DEFAULT_TTL_SECONDS = 60 * 60
+# how long a label the seed doesn't have waits for the first Firestore read
+DEFAULT_LOAD_WAIT_SECONDS = 5
+
+
+class FoodCatalog:
+    """
+    Process-local snapshot of `food_collection`.
+
+    The collection is a static table written by `migration.py`, so it is read
+    once at startup and served from memory afterwards. A snapshot is never
+    mutated: `refresh` builds new mappings and swaps them in, so readers
+    always see a consistent view without locking.
+    """
+
+    def __init__(self, db: Firestore, ttl: int = DEFAULT_TTL_SECONDS):
+        self.db = db
+        self.ttl = ttl
+        self._by_name: Mapping[str, Mapping] = MappingProxyType({})
+        self._by_id: Mapping[str, Mapping] = MappingProxyType({})
+        self._labels = LabelIndex([])
+        self._loaded_at = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        # set once a snapshot of Firestore, not only the CSV seed, is in
+        self._loaded = asyncio.Event()
+
+    async def load(self):
+        await self.refresh()
+
+    async def refresh(self):
+        self.seed(await self.db.get_all_food())
+        self._loaded.set()
+
+    def seed(self, foods: List[Dict]):
+        # Also called before the workers fork, with the rows of food_raw.csv,
+        # so every worker starts with the snapshot already in shared memory.
+        by_name = {}
+        by_id = {}
+        for food in foods:
+            entry = MappingProxyType(food)
+            by_name[food["name"]] = entry
+            by_id[food["id"]] = entry
+
+        self._by_name = MappingProxyType(by_name)
+        self._by_id = MappingProxyType(by_id)
+        self._labels = LabelIndex(by_name.values())
+        self._loaded_at = time.monotonic()
+
+    def resolve(self, label: str) -> Optional[Mapping]:
+        # a classifier label, matched to the name as described in LabelIndex
+        self._refresh_if_stale()
+        return self._labels.resolve(label)
+
+    async def resolve_loaded(
+        self, label: str, timeout: float = DEFAULT_LOAD_WAIT_SECONDS
+    ) -> Optional[Mapping]:
+        # For a label resolve() missed: foods that are only kept in Firestore
+        # aren't in the CSV seed, so until Firestore has been read once the
+        # label waits for that read and is resolved again.
+        if self._loaded.is_set():
+            return None
+
+        try:
+            await asyncio.wait_for(self._loaded.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        return self.resolve(label)
+
+    def get_by_id(self, food_id: str) -> Optional[Mapping]:
+        self._refresh_if_stale()
+        return self._by_id.get(food_id)
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def _refresh_if_stale(self):
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return
+
+        if self._refreshing is not None and not self._refreshing.done():
+            return
+
+        # serve the current snapshot while the new one loads in the background
+        self._refreshing = asyncio.get_running_loop().create_task(
+            self._background_refresh()
+        )
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print("FoodCatalog.refresh:", e)
+            # don't retry on every lookup, wait for the next ttl window
+            self._loaded_at = time.monotonic()
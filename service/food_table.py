@@ -0,0 +1,171 @@
+import csv
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .foods import FOOD_CSV
+
+# food_raw.csv column of every nutrient, all of them per 100 g
+NUTRIENT_COLUMNS = {
+    "air": 7,
+    "energi": 8,
+    "protein": 9,
+    "lemak": 10,
+    "karbohidrat": 11,
+    "serat": 12,
+    "abu": 13,
+    "kalsium": 14,
+    "fosfor": 15,
+    "besi": 16,
+    "natrium": 17,
+    "kalium": 18,
+    "tembaga": 19,
+    "seng": 20,
+    "retinol": 21,
+    "beta_karoten": 22,
+    "karoten_total": 23,
+    "thiamin": 24,
+    "riboflavin": 25,
+    "niasin": 26,
+    "vitamin_c": 27,
+    "bdd": 28,
+}
+
+CATEGORY_COLUMNS = {
+    "fast_food": 3,
+    "tipe": 5,
+    "jenis_olahan": 6,
+    "mentah_olahan": 29,
+    "kelompok_makanan": 30,
+}
+
+
+class FoodTable:
+    """
+    food_raw.csv held column by column in NumPy arrays.
+
+    `nutrients` is a float matrix with one row per food and one column per
+    NUTRIENT_COLUMNS entry, in that order. Category columns are stored as
+    integer codes into a sorted tuple of labels, and `category_codes` maps
+    every lowercased label back to its code. The arrays are read-only, so
+    the table loaded before the gunicorn fork is shared by every worker.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        names: List[str],
+        nutrients: np.ndarray,
+        categories: Dict[str, Tuple[np.ndarray, Tuple[str, ...]]],
+    ):
+        self.ids = tuple(ids)
+        self.names = tuple(names)
+        self.nutrients = nutrients
+        self.categories = categories
+        self.nutrient_index = {name: i for i, name in enumerate(NUTRIENT_COLUMNS)}
+        self.category_codes = {
+            category: {label.lower(): code for code, label in enumerate(labels)}
+            for category, (_, labels) in categories.items()
+        }
+        # position of every food in name order, for sorting by name
+        self.name_rank = np.empty(len(self.names), dtype=np.int32)
+        self.name_rank[np.argsort([name.lower() for name in self.names])] = np.arange(
+            len(self.names)
+        )
+
+        self.nutrients.setflags(write=False)
+        self.name_rank.setflags(write=False)
+        for codes, _ in self.categories.values():
+            codes.setflags(write=False)
+
+    @classmethod
+    def from_csv(cls, path: str = FOOD_CSV) -> "FoodTable":
+        with open(path, "r") as f:
+            csvreader = csv.reader(f)
+            _ = next(csvreader)
+            rows = list(csvreader)
+
+        nutrients = np.array(
+            [[float(row[col]) for col in NUTRIENT_COLUMNS.values()] for row in rows],
+            dtype=np.float64,
+        ).reshape(len(rows), len(NUTRIENT_COLUMNS))
+
+        categories = {}
+        for name, col in CATEGORY_COLUMNS.items():
+            labels, codes = np.unique(
+                [row[col].strip() for row in rows], return_inverse=True
+            )
+            categories[name] = (
+                codes.astype(np.int16),
+                tuple(str(label) for label in labels),
+            )
+
+        return cls(
+            ids=[row[1] for row in rows],
+            names=[row[2] for row in rows],
+            nutrients=nutrients,
+            categories=categories,
+        )
+
+    def column(self, name: str) -> np.ndarray:
+        return self.nutrients[:, self.nutrient_index[name]]
+
+    def columns(self, names: List[str]) -> np.ndarray:
+        return self.nutrients[:, [self.nutrient_index[name] for name in names]]
+
+    def is_category(self, category: str, label: str) -> np.ndarray:
+        return self.in_categories(category, [label])
+
+    def in_categories(self, category: str, labels: List[str]) -> np.ndarray:
+        # boolean mask of the foods whose `category` is any of `labels`,
+        # compared case-insensitively
+        codes, _ = self.categories[category]
+        known = self.category_codes[category]
+        wanted = [known[label.lower()] for label in labels if label.lower() in known]
+
+        return np.isin(codes, wanted)
+
+    def query(
+        self,
+        ranges: Dict[str, Tuple[Optional[float], Optional[float]]],
+        categories: Dict[str, List[str]],
+        sort: str = "name",
+        descending: bool = False,
+        offset: int = 0,
+        limit: int = 20,
+    ) -> Tuple[int, np.ndarray]:
+        """
+        Row indexes of one page of the foods within every nutrient range
+        (inclusive, None for an open end) and in any of the labels of every
+        category, sorted by a nutrient or "name". Returns the match count
+        with them.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, (low, high) in ranges.items():
+            column = self.column(name)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+
+        for category, labels in categories.items():
+            mask &= self.in_categories(category, labels)
+
+        matches = np.flatnonzero(mask)
+        keys = self.name_rank[matches] if sort == "name" else self.column(sort)[matches]
+        if descending:
+            keys = -keys
+        matches = matches[np.argsort(keys, kind="stable")]
+
+        return len(matches), matches[offset : offset + limit]
+
+    def food(self, i: int) -> Dict:
+        food = {"id": self.ids[i], "name": self.names[i]}
+        for category, (codes, labels) in self.categories.items():
+            food[category] = labels[codes[i]]
+        food["nutrients"] = dict(zip(NUTRIENT_COLUMNS, self.nutrients[i].tolist()))
+
+        return food
+
+    def __len__(self) -> int:
+        return len(self.ids)
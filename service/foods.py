@@ -0,0 +1,56 @@
+import csv
+from typing import Dict, Iterator, List
+
+FOOD_CSV = "food_raw.csv"
+
+
+def food_document(row: List[str]) -> Dict:
+    # one food_raw.csv row as migration.py stores it in food_collection
+    calories = int(row[8])
+
+    return {
+        "id": row[1],
+        "name": row[2],
+        "calories": calories,
+        "calories_for_2x": calories * 4,
+        "calories_for_3x": int(calories * 2.7),
+        "calories_for_4x": calories * 2,
+        "protein": int(round(float(row[9]))),
+        "lemak": int(round(float(row[10]))),
+        "karbohidrat": int(round(float(row[11]))),
+        # vitamin ganti serat
+        "vitamin": int(round(float(row[12]))),
+        # mineral pake air
+        "mineral": int(round(float(row[7]))),
+    }
+
+
+def food_from_document(name: str, doc: Dict) -> Dict:
+    # the food as the services use it, from a food_collection document
+    return {
+        "id": doc["id"],
+        "name": name,
+        "calories_for_2x": doc["calories_for_2x"],
+        "calories_for_3x": doc["calories_for_3x"],
+        "calories_for_4x": doc["calories_for_4x"],
+        "karbohidrat": doc.get("karbohidrat", 0),
+        "lemak": doc.get("lemak", 0),
+        "mineral": doc.get("mineral", 0),
+        "protein": doc.get("protein", 0),
+        "vitamin": doc.get("vitamin", 0),
+        "img": doc.get("img", ""),
+    }
+
+
+def iter_food_documents(path: str = FOOD_CSV) -> Iterator[Dict]:
+    # row by row, the file is never held in memory as a whole
+    with open(path, "r") as f:
+        csvreader = csv.reader(f)
+        _ = next(csvreader)
+
+        for row in csvreader:
+            yield food_document(row)
+
+
+def read_foods(path: str = FOOD_CSV) -> List[Dict]:
+    return [food_from_document(doc["name"], doc) for doc in iter_food_documents(path)]
@@ -1,15 +1,132 @@
+import asyncio
+import base64
+import contextlib
 import datetime
+import json
 import pytz
+from contextvars import ContextVar
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
-from typing import Optional, Dict
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.cloud.exceptions import NotFound
+from typing import Any, Callable, Optional, Dict, List, Set, Tuple
 
+from ..cache import LRUCache
+from ..foods import food_from_document
+from ..metrics import instrument, register_cache
 
-class Firestore:
-    def __init__(self, db):
+ML_ID_BLOCK_SIZE = 20
+
+PROFILE_CACHE_SIZE = 10_000
+# other workers may write a profile too, this bounds how stale a copy can be
+PROFILE_CACHE_TTL_SECONDS = 5 * 60
+
+
+class _DocumentLoader:
+    # Batches and dedupes document reads for one request. Loads requested in
+    # the same event loop tick are dispatched together as one get_all call.
+    def __init__(self, db: firestore.AsyncClient):
         self.db = db
+        self.snapshots: Dict[str, asyncio.Future] = {}
+        self.pending: Dict[str, Tuple[Any, asyncio.Future]] = {}
+        # the event loop only keeps weak references to tasks
+        self.tasks: Set[asyncio.Task] = set()
+
+    def load(self, doc_ref) -> asyncio.Future:
+        # every caller gets its own shield, one that is cancelled must not
+        # cancel the read the others are waiting for
+        snapshot = self.snapshots.get(doc_ref.path)
+        if snapshot is not None:
+            return asyncio.shield(snapshot)
+
+        loop = asyncio.get_running_loop()
+        snapshot = loop.create_future()
+        self.snapshots[doc_ref.path] = snapshot
+
+        if not self.pending:
+            loop.call_soon(self.__schedule)
+        self.pending[doc_ref.path] = (doc_ref, snapshot)
+
+        return asyncio.shield(snapshot)
+
+    def forget(self, doc_ref):
+        self.snapshots.pop(doc_ref.path, None)
+
+    async def dispatch(self):
+        batch, self.pending = self.pending, {}
+
+        try:
+            refs = [doc_ref for doc_ref, _ in batch.values()]
+            async for doc in self.db.get_all(refs):
+                _, snapshot = batch[doc.reference.path]
+                if not snapshot.done():
+                    snapshot.set_result(doc)
 
-    def save_nutrition_data(self, user_id: str, img_url: str) -> dict:
+        except asyncio.CancelledError:
+            self.__fail(batch, None)
+            raise
+
+        except Exception as e:
+            self.__fail(batch, e)
+
+        else:
+            # a reference get_all skipped would otherwise wait forever
+            self.__fail(batch, NotFound("get_all returned no snapshot"))
+
+    def __schedule(self):
+        task = asyncio.get_running_loop().create_task(self.dispatch())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def __fail(self, batch: Dict, e: Optional[BaseException]):
+        # every load still waiting gets the error, or is cancelled with None
+        for path, (_, snapshot) in batch.items():
+            if snapshot.done():
+                continue
+
+            # don't keep a failed read around for the next caller
+            self.snapshots.pop(path, None)
+            if e is None:
+                snapshot.cancel()
+            else:
+                snapshot.set_exception(e)
+
+
+_request_loader: ContextVar[Optional[_DocumentLoader]] = ContextVar(
+    "firestore_request_loader", default=None
+)
+
+
+class Firestore:
+    # The client is built by `connect` in start(), inside the worker that
+    # uses it: the gRPC channel must not be created before the event loop.
+    def __init__(
+        self,
+        connect: Callable[[], firestore.AsyncClient],
+        profile_cache_size: int = PROFILE_CACHE_SIZE,
+        profile_cache_ttl: float = PROFILE_CACHE_TTL_SECONDS,
+    ):
+        self.__connect = connect
+        self.db: Optional[firestore.AsyncClient] = None
+        self.profile_cache = LRUCache(
+            max_size=profile_cache_size, ttl=profile_cache_ttl
+        )
+        register_cache("profile", self.profile_cache.stats)
+        self.__ml_id_lock = asyncio.Lock()
+        self.__ml_id_next = 0
+        self.__ml_id_end = 0
+
+    async def start(self):
+        if self.db is None:
+            self.db = self.__connect()
+
+        # any read proves the credentials and the project are usable
+        await self.db.collection("global_id_for_ml").document("id").get()
+
+    @instrument("firestore")
+    async def save_nutrition_data(
+        self, user_id: str, img_url: str, img_generation: Optional[int] = None
+    ) -> dict:
         doc_ref = self.db.collection("user_nutrition").document()
 
         data = {
@@ -18,62 +135,83 @@ class Firestore:
             "created_at": self.__curr_time().strftime("%Y-%m-%d %H:%M:%S"),
         }
 
-        doc_ref.set(
-            {"user_id": user_id, "img_url": img_url, "created_at": self.__curr_time()}
+        await doc_ref.set(
+            {
+                "user_id": user_id,
+                "img_url": img_url,
+                "img_generation": img_generation,
+                "created_at": self.__curr_time(),
+            }
         )
 
         return data
 
-    def get_count_nutrition_input_today(self, user_id: str) -> int:
-        gmt7 = pytz.timezone("Asia/Jakarta")
-        now_gmt7 = datetime.datetime.now(gmt7)
-        start_of_day_gmt7 = datetime.datetime(
-            now_gmt7.year, now_gmt7.month, now_gmt7.day, tzinfo=gmt7
-        )
-        end_of_day_gmt7 = start_of_day_gmt7 + datetime.timedelta(days=1)
+    @instrument("firestore")
+    async def consume_daily_quota(
+        self, user_id: str, day: str, kind: str, limit: int
+    ) -> Optional[int]:
+        doc_ref = self.db.collection("user_quota").document(f"{user_id}_{day}")
 
-        collection_ref = self.db.collection("user_nutrition")
-        query = (
-            collection_ref.where(
-                filter=FieldFilter(field_path="user_id", op_string="==", value=user_id)
-            )
-            .where(
-                filter=FieldFilter(
-                    field_path="created_at", op_string=">=", value=start_of_day_gmt7
-                )
-            )
-            .where(
-                filter=FieldFilter(
-                    field_path="created_at", op_string="<", value=end_of_day_gmt7
-                )
+        @firestore.async_transactional
+        async def consume(transaction) -> Optional[int]:
+            snapshot = await doc_ref.get(transaction=transaction)
+            count = (snapshot.to_dict() or {}).get(kind, 0)
+
+            if count >= limit:
+                return None
+
+            transaction.set(
+                doc_ref,
+                {"user_id": user_id, "day": day, kind: count + 1},
+                merge=True,
             )
-            .count()
-        )
+            return count + 1
+
+        return await consume(self.db.transaction())
 
-        result = query.get()
+    @instrument("firestore")
+    async def release_daily_quota(self, user_id: str, day: str, kind: str):
+        doc_ref = self.db.collection("user_quota").document(f"{user_id}_{day}")
+        await doc_ref.update({kind: firestore.Increment(-1)})
 
-        return result[0][0].value
+    @instrument("firestore")
+    async def get_daily_quota(self, user_id: str, day: str, kind: str) -> int:
+        doc_ref = self.db.collection("user_quota").document(f"{user_id}_{day}")
+        snapshot = await doc_ref.get()
 
-    def get_all_user_nutrition_photo(self, user_id: str, skip: int) -> list:
+        return (snapshot.to_dict() or {}).get(kind, 0)
+
+    @instrument("firestore")
+    async def get_all_user_nutrition_photo(
+        self, user_id: str, cursor: Optional[str], page_size: int
+    ) -> Tuple[list, Optional[str]]:
         collection_ref = self.db.collection("user_nutrition")
-        page_size = 10
 
+        # one extra document tells whether there is a next page; the id breaks
+        # ties between photos created at the same instant
         query = (
             collection_ref.where(
                 filter=FieldFilter(field_path="user_id", op_string="==", value=user_id)
             )
             .order_by("created_at", direction=firestore.Query.DESCENDING)
-            .limit(page_size)
+            .order_by(
+                FieldPath.document_id(),
+                direction=firestore.Query.DESCENDING,
+            )
+            .limit(page_size + 1)
         )
 
-        if skip > 0:
-            query = query.start_after({"created_at": skip * page_size})
+        if cursor is not None:
+            created_at, doc_id = self.__decode_cursor(cursor)
+            query = query.start_after(
+                {"created_at": created_at, "__name__": collection_ref.document(doc_id)}
+            )
 
-        results = query.get()
+        results = await query.get()
 
         user_nutrition_photos = []
 
-        for result in results:
+        for result in results[:page_size]:
             r = result.to_dict()
 
             doc = {
@@ -85,12 +223,20 @@ class Firestore:
 
             user_nutrition_photos.append(doc)
 
-        return user_nutrition_photos
+        next_cursor = None
+        if len(results) > page_size:
+            last = results[page_size - 1]
+            next_cursor = self.__encode_cursor(last.get("created_at"), last.id)
+
+        return user_nutrition_photos, next_cursor
 
-    def is_user_exists(self, user_id: str) -> bool:
-        return True if self.db.collection("user_detail").document(user_id) else False
+    @instrument("firestore")
+    async def is_user_exists(self, user_id: str) -> bool:
+        user = await self.__get(self.db.collection("user_detail").document(user_id))
+        return user.exists
 
-    def init_user_detail(self, user_id: str):
+    @instrument("firestore")
+    async def init_user_detail(self, user_id: str):
         collection_ref = self.db.collection("user_detail").document(user_id)
         updated_data = {
             "weight": 0,
@@ -101,44 +247,45 @@ class Firestore:
             "eat_per_day": 3,
             "user_id": user_id,
             "has_been_updated": False,
-            "ml_id": self.get_global_id_and_update(),
+            "ml_id": await self.get_global_id_and_update(),
         }
 
-        collection_ref.set(updated_data)
-
-    def init_user_scan_count(self, user_id: str):
-        collection_ref = self.db.collection("user_scan_count").document(user_id)
-        collection_ref.set({"count": 0})
+        await collection_ref.set(updated_data)
+        self.__forget(collection_ref)
+        self.profile_cache.set(user_id, self.__user_detail_from_dict(updated_data))
 
-    def get_user_scan_count(self, user_id: str) -> int:
-        collection_ref = self.db.collection("user_scan_count").document(user_id)
-        ref = collection_ref.get().to_dict()
-        return ref["count"]
+    @instrument("firestore")
+    async def get_user_detail(self, user_id: str) -> Optional[Dict]:
+        cached = self.profile_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
 
-    def increment_user_scan_count(self, user_id: str):
-        collection_ref = self.db.collection("user_scan_count").document(user_id)
-        count = self.get_user_scan_count(user_id)
-        collection_ref.set({"count": count + 1})
-
-    def get_user_detail(self, user_id: str) -> Optional[Dict]:
         collection_ref = self.db.collection("user_detail").document(user_id)
-        user = collection_ref.get()
+        user = await self.__get(collection_ref)
 
         if user.exists:
-            data = user.to_dict()
-            return {
-                "weight": data.get("weight", 0),
-                "sex": data.get("sex", ""),
-                "calories_target": data.get("calories_target", 0),
-                "height": data.get("height", 0),
-                "age": data.get("age", 0),
-                "eat_per_day": data.get("eat_per_day", 0),
-                "has_been_updated": data.get("has_been_updated", False),
-            }
+            user_detail = self.__user_detail_from_dict(user.to_dict())
+            self.profile_cache.set(user_id, user_detail)
+            return dict(user_detail)
 
         return None
 
-    def save_user_detail(
+    # The profile straight from Firestore, with its version, for when a copy
+    # from the cache, up to PROFILE_CACHE_TTL_SECONDS old, won't do.
+    @instrument("firestore")
+    async def read_user_detail(self, user_id: str) -> Optional[Tuple[Dict, int]]:
+        user = await self.__get(self.db.collection("user_detail").document(user_id))
+        if not user.exists:
+            return None
+
+        data = user.to_dict()
+        user_detail = self.__user_detail_from_dict(data)
+        self.profile_cache.set(user_id, user_detail)
+
+        return dict(user_detail), data.get("profile_version", 0)
+
+    @instrument("firestore")
+    async def save_user_detail(
         self,
         weight: int,
         height: int,
@@ -150,11 +297,7 @@ class Firestore:
     ) -> Optional[Dict]:
         collection_ref = self.db.collection("user_detail").document(user_id)
 
-        if not collection_ref:
-            return None
-
-        ml_id = collection_ref.get().to_dict()["ml_id"]
-
+        # update() merges, so ml_id stays as it is without reading it first
         updated_data = {
             "weight": weight,
             "sex": sex,
@@ -164,64 +307,134 @@ class Firestore:
             "eat_per_day": eat_per_day,
             "user_id": user_id,
             "has_been_updated": True,
-            "ml_id": ml_id,
+            # what a saved recommendation is checked against, in every worker
+            "profile_version": firestore.Increment(1),
         }
 
-        collection_ref.update(updated_data)
+        try:
+            await collection_ref.update(updated_data)
+        except NotFound:
+            self.profile_cache.delete(user_id)
+            return None
+        finally:
+            self.__forget(collection_ref)
 
-        return {
-            "weight": weight,
-            "sex": sex,
-            "calories_target": calories_target,
-            "height": height,
-            "eat_per_day": eat_per_day,
-            "age": age,
-            "has_been_updated": True,
-        }
+        user_detail = self.__user_detail_from_dict(updated_data)
+        self.profile_cache.set(user_id, user_detail)
 
-    def get_global_id_and_update(self) -> str:
-        collection_ref = self.db.collection("global_id_for_ml").document("id")
-        global_id = collection_ref.get()
+        return dict(user_detail)
 
-        result_id = global_id.to_dict()["current"]
+    # The profile photo the user detail points at, with the generation of
+    # its blob. Kept apart from the profile, which is returned to clients.
+    @instrument("firestore")
+    async def get_profile_photo(self, user_id: str) -> Optional[Dict]:
+        user = await self.__get(self.db.collection("user_detail").document(user_id))
+        if not user.exists:
+            return None
 
-        collection_ref.update({"current": self.__get_increment_global_id(result_id)})
+        return user.to_dict().get("photo")
 
-        return result_id
+    @instrument("firestore")
+    async def save_profile_photo(self, user_id: str, photo_url: str, generation: int):
+        collection_ref = self.db.collection("user_detail").document(user_id)
+        try:
+            await collection_ref.update(
+                {"photo": {"url": photo_url, "generation": generation}}
+            )
+        finally:
+            self.__forget(collection_ref)
 
-    def get_food_by_name(self, name: str) -> dict:
-        query_param = "Lontong" if name == "Lontong" or name == "lontong" else name
+    @instrument("firestore")
+    async def get_global_id_and_update(self) -> str:
+        # hi/lo: ids are handed out from a block reserved in one transaction,
+        # so only one in every ML_ID_BLOCK_SIZE signups touches the shared
+        # document. Ids left in a block when the worker exits are skipped.
+        async with self.__ml_id_lock:
+            if self.__ml_id_next >= self.__ml_id_end:
+                self.__ml_id_next, self.__ml_id_end = await self.__reserve_ml_ids()
 
-        collection_ref = self.db.collection("food_collection").document(query_param)
+            num = self.__ml_id_next
+            self.__ml_id_next += 1
 
-        result = collection_ref.get().to_dict()
+        return self.__format_global_id(num)
 
-        return {
-            "id": result["id"],
-            "name": query_param,
-            "calories_for_2x": result["calories_for_2x"],
-            "calories_for_3x": result["calories_for_3x"],
-            "calories_for_4x": result["calories_for_4x"],
-            "karbohidrat": result.get("karbohidrat", 0),
-            "lemak": result.get("lemak", 0),
-            "mineral": result.get("mineral", 0),
-            "protein": result.get("protein", 0),
-            "vitamin": result.get("vitamin", 0),
-            "img": result.get("img", ""),
-        }
+    @instrument("firestore")
+    async def get_food_by_name(self, name: str) -> Optional[Dict]:
+        collection_ref = self.db.collection("food_collection").document(name)
 
-    def get_recommendation_food(self, user_id: str, eat_per_day: int) -> Optional[Dict]:
-        food_recom_collection = self.db.collection("food_recommendation").document(
-            user_id
-        )
-        ref = food_recom_collection.get()
+        ref = await self.__get(collection_ref)
+        if not ref.exists:
+            return None
+
+        return food_from_document(name, ref.to_dict())
+
+    @instrument("firestore")
+    async def get_all_food(self) -> List[Dict]:
+        collection_ref = self.db.collection("food_collection")
+
+        foods = []
+        async for doc in collection_ref.stream():
+            foods.append(food_from_document(doc.id, doc.to_dict()))
 
-        if ref is None:
+        return foods
+
+    # The saved recommendation with the version of the profile it was made
+    # from, None for a version from before it was recorded.
+    @instrument("firestore")
+    async def get_recommendation_food(
+        self, user_id: str
+    ) -> Optional[Tuple[Dict, Optional[int]]]:
+        doc_ref = self.db.collection("food_recommendation").document(user_id)
+        ref = await self.__get(doc_ref)
+
+        if not ref.exists:
             return None
 
-        key = f"{eat_per_day}x"
+        # documents from the old generator keep it under "2x", "3x" and "4x"
+        data = ref.to_dict()
+        if "recommendation" not in data:
+            return None
 
-        return ref.to_dict()[key]
+        return data["recommendation"], data.get("profile_version")
+
+    @instrument("firestore")
+    async def save_recommendation_food(
+        self, user_id: str, recommendation: Dict, profile_version: int
+    ):
+        doc_ref = self.db.collection("food_recommendation").document(user_id)
+
+        await doc_ref.set(
+            {
+                "user_id": user_id,
+                "recommendation": recommendation,
+                "profile_version": profile_version,
+                "created_at": self.__curr_time(),
+            }
+        )
+        self.__forget(doc_ref)
+
+    @contextlib.contextmanager
+    def request_scope(self):
+        # Reads inside the scope go through one loader: reads issued together
+        # are sent as a single get_all, and a document read once is served
+        # from memory for the rest of the scope.
+        token = _request_loader.set(_DocumentLoader(self.db))
+        try:
+            yield
+        finally:
+            _request_loader.reset(token)
+
+    async def __get(self, doc_ref):
+        loader = _request_loader.get()
+        if loader is None:
+            return await doc_ref.get()
+
+        return await loader.load(doc_ref)
+
+    def __forget(self, doc_ref):
+        loader = _request_loader.get()
+        if loader is not None:
+            loader.forget(doc_ref)
 
     # GMT +7
     def __curr_time(self) -> datetime:
@@ -237,9 +450,48 @@ class Firestore:
 
         return utc7_timestamp_str
 
-    def __get_increment_global_id(self, id: str) -> str:
-        num_str = id[3:]
-        num = int(num_str)
-        num += 1
-        output = f"UNT{num:03d}"
-        return output
+    # opaque to clients: urlsafe base64 of the last (created_at, doc id)
+    def __encode_cursor(self, created_at: datetime.datetime, doc_id: str) -> str:
+        raw = json.dumps([created_at.isoformat(), doc_id])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def __decode_cursor(self, cursor: str) -> Tuple[datetime.datetime, str]:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+            if not isinstance(doc_id, str) or not doc_id or "/" in doc_id:
+                raise ValueError(doc_id)
+            return datetime.datetime.fromisoformat(created_at), doc_id
+        except (TypeError, ValueError) as e:
+            raise ValueError("invalid cursor") from e
+
+    def __user_detail_from_dict(self, data: dict) -> dict:
+        return {
+            "weight": data.get("weight", 0),
+            "sex": data.get("sex", ""),
+            "calories_target": data.get("calories_target", 0),
+            "height": data.get("height", 0),
+            "age": data.get("age", 0),
+            "eat_per_day": data.get("eat_per_day", 0),
+            "has_been_updated": data.get("has_been_updated", False),
+        }
+
+    async def __reserve_ml_ids(self) -> Tuple[int, int]:
+        doc_ref = self.db.collection("global_id_for_ml").document("id")
+
+        @firestore.async_transactional
+        async def reserve(transaction) -> Tuple[int, int]:
+            snapshot = await doc_ref.get(transaction=transaction)
+            start = self.__parse_global_id(snapshot.to_dict()["current"])
+            end = start + ML_ID_BLOCK_SIZE
+
+            transaction.update(doc_ref, {"current": self.__format_global_id(end)})
+            return start, end
+
+        return await reserve(self.db.transaction())
+
+    def __parse_global_id(self, id: str) -> int:
+        return int(id[3:])
+
+    def __format_global_id(self, num: int) -> str:
+        return f"UNT{num:03d}"
@@ -1,54 +1,139 @@
-from typing import BinaryIO
+import io
+from typing import BinaryIO, Callable, List, Optional, Tuple
 
 import shortuuid
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 from google.cloud import storage
-from google.cloud.exceptions import NotFound
+from google.cloud.exceptions import NotFound, PreconditionFailed
 from google.cloud.storage.bucket import Bucket
 
+from ..image import DEFAULT_MAX_PHOTO_BYTES, SNIFF_BYTES, sniff_content_type
+from ..metrics import instrument
 
+# resumable uploads are sent in multiples of 256 KiB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# the JSON API accepts at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+
+
+# google-cloud-storage has no async transport, so every network call is
+# pushed to the threadpool to keep the event loop free. The client is built
+# by `connect` in start(), so constructing a Storage costs no round trip.
 class Storage:
-    def __init__(self, client: storage.Client, bucket_name: str):
+    def __init__(
+        self,
+        connect: Callable[[], storage.Client],
+        bucket_name: str,
+        max_upload_bytes: int = DEFAULT_MAX_PHOTO_BYTES,
+    ):
         self.bucket_name = bucket_name
-        self.bucket: Bucket = client.get_bucket(bucket_name)
+        self.__connect = connect
+        self.client: Optional[storage.Client] = None
+        self.bucket: Optional[Bucket] = None
+        self.max_upload_bytes = max_upload_bytes
+
+    async def start(self):
+        if self.client is None:
+            self.client = await run_in_threadpool(self.__connect)
+
+        self.bucket = await run_in_threadpool(self.client.get_bucket, self.bucket_name)
+
+    # Returns the public URL and the generation of the blob, the latter lets
+    # a later delete make sure it removes this very upload.
+    @instrument("storage")
+    async def store(
+        self, path: str, file: BinaryIO, content_type: str
+    ) -> Tuple[str, int]:
+        # the declared content type is not trusted, the magic bytes decide
+        head = await run_in_threadpool(file.read, SNIFF_BYTES)
+        file.seek(-len(head), io.SEEK_CUR)
+        content_type = sniff_content_type(head)
+        if content_type is None:
+            raise HTTPException(
+                status_code=415, detail="Only JPEG, PNG or WebP photos are allowed"
+            )
 
-    def store(self, path: str, file: BinaryIO, content_type: str) -> str:
         save_as = self.__id()
         blob = self.bucket.blob(f"{path}/{save_as}")
-        blob.upload_from_file(file, content_type=content_type)
-        return f"https://storage.googleapis.com/{self.bucket_name}/{path}/{save_as}"
+        await run_in_threadpool(self.__upload, blob, file, content_type)
+        return (
+            f"https://storage.googleapis.com/{self.bucket_name}/{path}/{save_as}",
+            blob.generation,
+        )
+
+    async def destroy(self, path: str, user_id: str):
+        await self.destruct(path=f"{user_id}/profile", photo_id=path)
 
-    def destroy(self, path: str, user_id: str):
+    async def destruct(
+        self, path: str, photo_id: str, generation: Optional[int] = None
+    ):
         try:
-            if self.__folder_exists(f"{user_id}/profile"):
-                blob = self.bucket.blob(f"{user_id}/profile/{path}")
-                print(f"{user_id}/profile/{path}")
-                blob.delete()
-        except NotFound:
-            raise HTTPException(status_code=400, detail="Image not found")
+            await self.delete(f"{path}/{photo_id}", generation=generation)
         except Exception as e:
-            print("gcp.Storage.destroy:", e)
+            print("gcp.Storage.destruct:", e)
             raise HTTPException(status_code=500, detail="Internal error")
 
-    def destruct(self, path: str, photo_id: str):
+    # A blob that is already gone counts as deleted. With `generation` the
+    # blob is only deleted if it wasn't overwritten since, otherwise False.
+    @instrument("storage")
+    async def delete(self, name: str, generation: Optional[int] = None) -> bool:
+        blob = self.bucket.blob(name)
         try:
-            if self.__folder_exists(path):
-                blob = self.bucket.blob(f"{path}/{photo_id}")
-                blob.delete()
+            await run_in_threadpool(blob.delete, if_generation_match=generation)
         except NotFound:
-            raise HTTPException(status_code=400, detail="Image not found")
-        except Exception as e:
-            print("gcp.Storage.destroy:", e)
-            raise HTTPException(status_code=500, detail="Internal error")
+            pass
+        except PreconditionFailed:
+            return False
 
-    def __id(self) -> str:
-        return shortuuid.uuid()
+        return True
+
+    # Deletes MAX_BATCH_SIZE blobs per HTTP call. `blobs` are names with the
+    # generation recorded at upload, or None; returns the names that failed.
+    @instrument("storage")
+    async def delete_many(self, blobs: List[Tuple[str, Optional[int]]]) -> List[str]:
+        failed = []
+        for i in range(0, len(blobs), MAX_BATCH_SIZE):
+            chunk = blobs[i : i + MAX_BATCH_SIZE]
+            try:
+                await run_in_threadpool(self.__delete_batch, chunk)
+            except Exception as e:
+                # a batch only raises its last error, so the blobs are deleted
+                # once more one by one to tell which of them failed
+                print("gcp.Storage.delete_many:", e)
+                for name, generation in chunk:
+                    try:
+                        if not await self.delete(name, generation=generation):
+                            failed.append(name)
+                    except Exception as e:
+                        print("gcp.Storage.delete_many:", name, e)
+                        failed.append(name)
+
+        return failed
 
-    def __folder_exists(self, path: str) -> bool:
-        folder_path = f"{path}/"
-        blobs = self.bucket.list_blobs(prefix=folder_path)
-        for blob in blobs:
-            if path in blob.name:
-                return True
+    def __delete_batch(self, blobs: List[Tuple[str, Optional[int]]]):
+        with self.client.batch():
+            self.bucket.delete_blobs(
+                [name for name, _ in blobs],
+                # a blob that is already gone counts as deleted
+                on_error=lambda blob: None,
+                if_generation_match=[generation for _, generation in blobs],
+            )
 
-        return False
+    def __upload(self, blob, file: BinaryIO, content_type: str):
+        start = file.tell()
+        size = file.seek(0, io.SEEK_END) - start
+        file.seek(start)
+        if size > self.max_upload_bytes:
+            raise HTTPException(status_code=413, detail="Photo is too large")
+
+        # a photo that fits in one chunk, as normalised ones do, is sent in a
+        # single request; a larger one goes through a resumable session. Both
+        # leave the created object, and so its generation, on the blob.
+        if size > UPLOAD_CHUNK_SIZE:
+            blob.chunk_size = UPLOAD_CHUNK_SIZE
+        blob.upload_from_file(file, size=size, content_type=content_type)
+
+    def __id(self) -> str:
+        return shortuuid.uuid()
@@ -0,0 +1,151 @@
+import asyncio
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .metrics import IMAGE_BYTES, IMAGE_LATENCY, IMAGES
+from .tracing import traced
+
+# enough bytes to tell every accepted format apart
+SNIFF_BYTES = 12
+
+DEFAULT_MAX_PHOTO_BYTES = 10 * 1024 * 1024
+# photos are read piece by piece, so an oversized one is refused before it
+# is all in memory
+READ_CHUNK_BYTES = 256 * 1024
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+
+    return None
+
+
+def read_photo(file: BinaryIO, max_bytes: int) -> bytes:
+    chunks, size = [], 0
+    while True:
+        chunk = file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return b"".join(chunks)
+
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail="Photo is too large")
+
+        chunks.append(chunk)
+
+
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_FORMAT = "JPEG"
+DEFAULT_QUALITY = 85
+
+FORMAT_CONTENT_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def normalize_image(data: bytes, max_side: int, format: str, quality: int) -> bytes:
+    # runs in a worker process, keep it free of anything that isn't picklable
+    with Image.open(io.BytesIO(data)) as img:
+        # let the JPEG decoder scale down while decoding, it is much cheaper
+        img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_side, max_side))
+
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        output = io.BytesIO()
+        img.save(output, format=format, quality=quality, optimize=True)
+
+    return output.getvalue()
+
+
+class ImageNormalizer:
+    """
+    Decodes, orients, downscales and re-encodes photos before they are
+    stored or sent to the classifier. The work is CPU bound, so it runs in
+    a process pool and the event loop only awaits the result.
+    """
+
+    def __init__(
+        self,
+        max_side: int = DEFAULT_MAX_SIDE,
+        format: str = DEFAULT_FORMAT,
+        quality: int = DEFAULT_QUALITY,
+        max_workers: Optional[int] = None,
+    ):
+        if format not in FORMAT_CONTENT_TYPES:
+            raise ValueError(f"Unsupported image format: {format}")
+
+        self.max_side = max_side
+        self.format = format
+        self.quality = quality
+        self.content_type = FORMAT_CONTENT_TYPES[format]
+        self.max_workers = max_workers
+        # created on first use, so a pool built before a gunicorn fork is
+        # never shared by several workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    @traced
+    async def normalize(self, data: bytes) -> bytes:
+        start = time.perf_counter()
+
+        try:
+            try:
+                output = await self.__run(data)
+            except BrokenProcessPool as e:
+                # a worker died, e.g. killed for its memory, and took the
+                # pool with it; the photo gets one more go in a new pool
+                print("ImageNormalizer.normalize:", e)
+                output = await self.__run(data)
+        except (UnidentifiedImageError, OSError, ValueError):
+            raise HTTPException(status_code=415, detail="Can't read the photo")
+
+        IMAGES.inc()
+        IMAGE_BYTES.labels("in").inc(len(data))
+        IMAGE_BYTES.labels("out").inc(len(output))
+        IMAGE_LATENCY.observe(time.perf_counter() - start)
+
+        return output
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __run(self, data: bytes) -> bytes:
+        if self.executor is None:
+            # workers come from a forkserver, not a fork of this process with
+            # its event loop, threads and open connections
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+
+        executor = self.executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor,
+                normalize_image,
+                data,
+                self.max_side,
+                self.format,
+                self.quality,
+            )
+        except BrokenProcessPool:
+            # the first call to see it replaces the pool for everyone
+            if self.executor is executor:
+                self.executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .metrics import JOBS
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUED = 1000
+
+QUEUED = "queued"
+RUNNING = "running"
+
+
+class _Job:
+    def __init__(self, key: str):
+        self.key = key
+        self.state = QUEUED
+        self.queued_at = datetime.datetime.now(datetime.timezone.utc)
+        # submitted again while running, so it has to run once more
+        self.rerun = False
+
+    def status(self) -> Dict:
+        return {
+            "status": self.state,
+            "queued_at": self.queued_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class JobQueue:
+    """
+    Bounded in-process queue of keyed jobs, run by a pool of workers.
+
+    A job only carries its key, the handler reads whatever it needs when
+    the job runs. So a key that is already waiting isn't queued twice, and
+    a key submitted while its job runs is run once more afterwards: a burst
+    of submits for one key costs at most two runs. Once `max_queued` keys
+    are waiting, submit refuses new ones.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[str], Awaitable],
+        workers: int = DEFAULT_WORKERS,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.jobs: Dict[str, _Job] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self.__work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, key: str) -> Optional[Dict]:
+        # the job's status, or None when the queue is full
+        job = self.jobs.get(key)
+        if job is not None:
+            if job.state == RUNNING:
+                job.rerun = True
+            JOBS.labels(self.name, "coalesced").inc()
+            return job.status()
+
+        job = _Job(key)
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            JOBS.labels(self.name, "rejected").inc()
+            return None
+
+        self.jobs[key] = job
+        JOBS.labels(self.name, "queued").inc()
+        return job.status()
+
+    def status(self, key: str) -> Optional[Dict]:
+        # None once the job is done, its result is wherever the handler put it
+        job = self.jobs.get(key)
+        if job is None:
+            return None
+
+        return job.status()
+
+    async def __work(self):
+        while True:
+            key = await self._queue.get()
+            job = self.jobs[key]
+            job.state = RUNNING
+
+            try:
+                await self.handler(key)
+                JOBS.labels(self.name, "done").inc()
+            except Exception as e:
+                print(f"JobQueue.{self.name}: {key}:", e)
+                JOBS.labels(self.name, "failed").inc()
+            finally:
+                self.__finish(job)
+                self._queue.task_done()
+
+    def __finish(self, job: _Job):
+        if not job.rerun:
+            del self.jobs[job.key]
+            return
+
+        job.state = QUEUED
+        job.queued_at = datetime.datetime.now(datetime.timezone.utc)
+        job.rerun = False
+        try:
+            self._queue.put_nowait(job.key)
+        except asyncio.QueueFull:
+            del self.jobs[job.key]
+            JOBS.labels(self.name, "rejected").inc()
@@ -0,0 +1,133 @@
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Optional
+
+# classifier labels and other common spellings of foods whose catalog name
+# differs, by normalised label
+ALIASES = {
+    "gado gado": "Gado0Gado",
+    "sayur ares": "Sayu Ares",
+    "mie goreng": "Mi Goreng",
+    "klepon": "Kelepon, Kue",
+    "capcay": "Cap Cai, Sayur",
+    "cap cay": "Cap Cai, Sayur",
+    "pempek": "Pempek telur",
+    "ice cream": "Es Krim",
+    "lele goreng": "Ikan Lele Goreng",
+    "tempe goreng": "Tempe kedelai murni, goreng",
+    "telur ceplok": "Telur mata sapi",
+    "nasi putih": "Nasi",
+}
+
+# "Mangga, Segar" is found as "mangga" too, when no other food is
+QUALIFIERS = {"segar", "masakan", "sayur", "kue", "goreng", "bakar"}
+
+# how close, as the Dice coefficient of their trigrams, a label has to be
+# to a name to resolve to it. Only a misspelling is resolved that way: the
+# name has to have as many words, one of them the same, and be the only one
+# that close. "Ikan Bakar" is not "Ikan Patin bakar".
+MIN_SIMILARITY = 0.75
+# labels remembered per index, classifiers only have so many
+MAX_MEMOIZED = 10_000
+
+
+def normalize(label: str) -> str:
+    # lowercase ASCII words separated by single spaces
+    text = unicodedata.normalize("NFKD", label)
+    text = text.encode("ascii", "ignore").decode().lower()
+    return " ".join(re.split(r"[^a-z0-9]+", text)).strip()
+
+
+def trigrams(key: str) -> set:
+    padded = f" {key} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class LabelIndex:
+    """
+    Resolves classifier labels to catalog entries.
+
+    Built once per catalog snapshot. A label is looked up by its exact
+    name, then by its normalised form, which also covers ALIASES and names
+    without their qualifier. What's left goes to a misspelt name, if exactly
+    one is close enough by trigram similarity. Every answer, a miss included, is remembered, so
+    a label the classifier returns again costs one dict lookup.
+    """
+
+    def __init__(self, foods: Iterable[Mapping]):
+        self.by_name: Dict[str, Mapping] = {}
+        self.by_key: Dict[str, Mapping] = {}
+        for food in foods:
+            self.by_name[food["name"]] = food
+            self.by_key.setdefault(normalize(food["name"]), food)
+
+        for food in self.by_name.values():
+            head, _, qualifier = food["name"].rpartition(",")
+            if head and normalize(qualifier) in QUALIFIERS:
+                self.by_key.setdefault(normalize(head), food)
+
+            words = normalize(food["name"]).split(" ")
+            if len(words) > 1 and words[-1] == "segar":
+                self.by_key.setdefault(" ".join(words[:-1]), food)
+
+        for alias, name in ALIASES.items():
+            if name in self.by_name:
+                self.by_key.setdefault(alias, self.by_name[name])
+
+        self.keys: List[str] = list(self.by_key)
+        self.key_trigrams = [trigrams(key) for key in self.keys]
+        self.key_words = [set(key.split(" ")) for key in self.keys]
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for i, grams in enumerate(self.key_trigrams):
+            for gram in grams:
+                self.postings[gram].append(i)
+
+        self.memo: Dict[str, Optional[Mapping]] = {}
+
+    def resolve(self, label: str) -> Optional[Mapping]:
+        try:
+            return self.memo[label]
+        except KeyError:
+            pass
+
+        food = self.by_name.get(label)
+        if food is None:
+            key = normalize(label)
+            food = self.by_key.get(key)
+            if food is None and key:
+                food = self.__closest(key)
+
+        if len(self.memo) < MAX_MEMOIZED:
+            self.memo[label] = food
+
+        return food
+
+    def __closest(self, key: str) -> Optional[Mapping]:
+        grams = trigrams(key)
+
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for i in self.postings.get(gram, ()):
+                shared[i] += 1
+
+        words = set(key.split(" "))
+        found = None
+        for i, count in shared.items():
+            score = 2 * count / (len(grams) + len(self.key_trigrams[i]))
+            if score < MIN_SIMILARITY:
+                continue
+
+            name_words = self.key_words[i]
+            if len(name_words) != len(words) or not words & name_words:
+                continue
+
+            if found is not None:
+                # two names are that close, guessing could pick the wrong one
+                return None
+            found = i
+
+        if found is None:
+            return None
+
+        return self.by_key[self.keys[found]]
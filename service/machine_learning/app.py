@@ -1,19 +1,53 @@
-import json
-import os
-from gradio_client import Client
-from typing import Dict, Union
+import asyncio
+import base64
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+from fastapi import HTTPException
+
+from .. import tracing
+from ..metrics import instrument
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_TIMEOUT_SECONDS = 30.0
 
 
 class MLPredictions:
-    def __init__(self, food_prediction_api: str, food_recomendation_api: str):
-        self.food_predict_client = Client(food_prediction_api)
-        self.food_recomendation_client = Client(food_recomendation_api)
+    """
+    Async client for the Gradio prediction Spaces.
 
-    def predict_food(self, image_url: str) -> Dict[str, Union[str, list]]:
-        job = self.food_predict_client.predict(image_url, api_name="/predict")
+    Calls go straight to the Space's `/run/predict` REST endpoint over a
+    pooled keep-alive connection, and the JSON result is parsed in memory.
+    A semaphore caps the number of in-flight calls; callers over the cap
+    wait in the event loop instead of holding a thread. `transport` lets
+    tests and benchmarks answer the calls without a live Space.
+    """
 
-        with open(job, "r") as f:
-            data_dict = json.load(f)
+    def __init__(
+        self,
+        food_prediction_api: str,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.food_predict_url = self.__space_url(food_prediction_api)
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.transport = transport
+        self.__slots = asyncio.Semaphore(max_concurrency)
+        # created on first use, inside the worker: a connection pool built
+        # before a gunicorn fork would be shared by every worker
+        self.__client: Optional[httpx.AsyncClient] = None
+
+    @instrument("ml")
+    async def predict_food(
+        self, image: bytes, content_type: str
+    ) -> Dict[str, Union[str, list]]:
+        # the Image component of the Space takes the photo inline as base64
+        encoded = base64.b64encode(image).decode()
+        data_url = f"data:{content_type or 'image/jpeg'};base64,{encoded}"
+
+        data_dict = await self.__run(self.food_predict_url, [data_url])
 
         final_result: str = data_dict["label"]
         other_options: list = [
@@ -24,19 +58,56 @@ class MLPredictions:
 
         output_dict = {"final_result": final_result, "other_options": other_options}
 
-        os.remove(job)
         return output_dict
 
-    def predict_recommendation_food(
-        self,
-        uid: str,
-        age: int,
-        weight: int,
-        height: int,
-        calories_need: int,
-        gender: str,
-        amount_of_eat_every_day: int,
-    ):
-        job = self.food_recomendation_client(
-            uid, age, weight, height, calories_need, gender, amount_of_eat_every_day
-        )
+    async def start(self):
+        # every Gradio app serves its config, a 200 means the Space is up
+        response = await self.__http().get(f"{self.food_predict_url}/config")
+        response.raise_for_status()
+
+    async def close(self):
+        if self.__client is not None:
+            await self.__client.aclose()
+            self.__client = None
+
+    def __http(self) -> httpx.AsyncClient:
+        if self.__client is None:
+            self.__client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                transport=self.transport,
+            )
+
+        return self.__client
+
+    async def __run(self, space_url: str, data: List[Any]) -> Any:
+        try:
+            async with self.__slots:
+                response = await self.__http().post(
+                    f"{space_url}/run/predict",
+                    json={"data": data},
+                    headers=tracing.headers(),
+                )
+                response.raise_for_status()
+
+        except httpx.TimeoutException:
+            raise HTTPException(
+                status_code=503, detail="Prediction service is busy. Try again later"
+            )
+
+        except httpx.HTTPError as e:
+            print("MLPredictions:", e)
+            raise HTTPException(status_code=502, detail="Prediction service error")
+
+        return response.json()["data"][0]
+
+    def __space_url(self, src: str) -> str:
+        if src.startswith("http://") or src.startswith("https://"):
+            return src.rstrip("/")
+
+        # "owner/space-name" Hugging Face ids are served from owner-space-name.hf.space
+        subdomain = src.replace("/", "-").replace("_", "-").replace(".", "-").lower()
+        return f"https://{subdomain}.hf.space"
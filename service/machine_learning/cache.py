@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from ..cache import LRUCache
+from ..metrics import register_cache
+
+DEFAULT_MAX_SIZE = 1024
+
+
+class PredictionCache:
+    """
+    Food predictions keyed by the SHA-256 of the photo bytes.
+
+    Rescans and client retries of the same photo hit the in-memory LRU.
+    When `persist_dir` is set, every prediction is also written there as
+    `<sha256>.json`, so the cache survives restarts and is shared by the
+    workers of one instance.
+    """
+
+    def __init__(
+        self, max_size: int = DEFAULT_MAX_SIZE, persist_dir: Optional[str] = None
+    ):
+        self.memory = LRUCache(max_size=max_size)
+        self.persist_dir = persist_dir
+        register_cache("prediction", self.memory.stats)
+
+        if persist_dir is not None:
+            os.makedirs(persist_dir, exist_ok=True)
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        prediction = self.memory.get(key)
+        if prediction is not None or self.persist_dir is None:
+            return prediction
+
+        prediction = await run_in_threadpool(self.__read, key)
+        if prediction is not None:
+            self.memory.set(key, prediction)
+
+        return prediction
+
+    async def set(self, key: str, prediction: Dict):
+        self.memory.set(key, prediction)
+
+        if self.persist_dir is not None:
+            await run_in_threadpool(self.__write, key, prediction)
+
+    def stats(self) -> Dict:
+        return self.memory.stats()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.persist_dir, f"{key}.json")
+
+    def __read(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self.__path(key), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def __write(self, key: str, prediction: Dict):
+        # write to a temp file first so a concurrent reader never sees half a file
+        tmp_path = f"{self.__path(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(prediction, f)
+            os.replace(tmp_path, self.__path(key))
+        except OSError as e:
+            print("PredictionCache.write:", e)
@@ -0,0 +1,148 @@
+import functools
+import os
+import time
+from typing import Callable, Dict
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from . import tracing
+
+# the prediction Space can take up to its 30s timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUESTS = Counter(
+    "nusa_http_requests_total",
+    "HTTP requests by route template and status code.",
+    ["method", "route", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "nusa_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+DEPENDENCY_LATENCY = Histogram(
+    "nusa_dependency_call_duration_seconds",
+    "Latency of calls to Firestore, Cloud Storage, the prediction Space and "
+    "the identity endpoints.",
+    ["dependency", "method", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+QUOTA_REJECTIONS = Counter(
+    "nusa_quota_rejections_total",
+    "Scans and uploads refused because the daily quota was used up.",
+    ["kind"],
+)
+IMAGES = Counter(
+    "nusa_images_normalized_total",
+    "Photos decoded, downscaled and re-encoded before they are stored.",
+)
+IMAGE_BYTES = Counter(
+    "nusa_image_bytes_total",
+    "Bytes of the photos going into and coming out of normalisation.",
+    ["direction"],
+)
+IMAGE_LATENCY = Histogram(
+    "nusa_image_normalize_duration_seconds",
+    "Time to normalise a photo, waiting for a free worker process included.",
+    buckets=LATENCY_BUCKETS,
+)
+JOBS = Counter(
+    "nusa_jobs_total",
+    "Background jobs by queue and what happened to them.",
+    ["queue", "outcome"],
+)
+
+
+def instrument(dependency: str) -> Callable:
+    # Times an async method of a dependency wrapper into DEPENDENCY_LATENCY
+    # and traces it as a client span.
+    def decorator(fn: Callable) -> Callable:
+        name = f"{dependency}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                with tracing.span(
+                    name, kind=tracing.CLIENT, attributes={"dependency": dependency}
+                ):
+                    response = await fn(*args, **kwargs)
+                outcome = "ok"
+                return response
+            finally:
+                DEPENDENCY_LATENCY.labels(dependency, fn.__name__, outcome).observe(
+                    time.perf_counter() - start
+                )
+
+        return wrapper
+
+    return decorator
+
+
+class _CacheCollector:
+    # Reads the stats() of every registered cache at scrape time, so the
+    # caches themselves don't need to know about Prometheus.
+    def __init__(self):
+        self.caches: Dict[str, Callable[[], Dict]] = {}
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "nusa_cache_hits", "Cache lookups that found an entry.", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "nusa_cache_misses", "Cache lookups that found nothing.", labels=["cache"]
+        )
+        hit_ratio = GaugeMetricFamily(
+            "nusa_cache_hit_ratio",
+            "Hits over lookups since the process started.",
+            labels=["cache"],
+        )
+        size = GaugeMetricFamily(
+            "nusa_cache_entries", "Entries currently cached.", labels=["cache"]
+        )
+
+        for name, stats in list(self.caches.items()):
+            s = stats()
+            hits.add_metric([name], s["hits"])
+            misses.add_metric([name], s["misses"])
+            hit_ratio.add_metric([name], s["hit_ratio"])
+            size.add_metric([name], s["size"])
+
+        yield hits
+        yield misses
+        yield hit_ratio
+        yield size
+
+
+_cache_collector = _CacheCollector()
+REGISTRY.register(_cache_collector)
+
+
+def register_cache(name: str, stats: Callable[[], Dict]):
+    # `stats` returns LRUCache.stats() shaped dicts; a later cache with the
+    # same name replaces the earlier one
+    _cache_collector.caches[name] = stats
+
+
+def exposition() -> bytes:
+    # With several gunicorn workers, PROMETHEUS_MULTIPROC_DIR makes every
+    # worker write its samples there and a scrape adds them all up. The
+    # cache stats can't be merged that way and come from the worker that
+    # answers the scrape.
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(_cache_collector)
+    return generate_latest(registry)
@@ -1,121 +1,335 @@
-from typing import Any, BinaryIO
+import asyncio
+import io
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
 
 from . import result
+from .catalog import FoodCatalog
+from .food_table import NUTRIENT_COLUMNS, FoodTable
 from .gcp.firestore import Firestore
 from .gcp.storage import Storage
+from .image import ImageNormalizer, read_photo
+from .jobs import DEFAULT_MAX_QUEUED, DEFAULT_WORKERS, JobQueue
 from .machine_learning.app import MLPredictions
+from .machine_learning.cache import PredictionCache
+from .quota import SCAN, UPLOAD, Quota
+from .recommendation import RecommendationEngine
+from .tracing import traced
+
+# what a client polling a recommendation that is being generated should wait
+RECOMMENDATION_RETRY_SECONDS = 1
 
 
 class NutritionService:
-    def __init__(self, app: Any, storage: Storage, db: Firestore, ml: MLPredictions):
+    def __init__(
+        self,
+        app: Any,
+        storage: Storage,
+        db: Firestore,
+        ml: MLPredictions,
+        catalog: FoodCatalog,
+        quota: Quota,
+        prediction_cache: PredictionCache,
+        normalizer: ImageNormalizer,
+        food_table: FoodTable,
+        recommender: RecommendationEngine,
+        recommendation_workers: int = DEFAULT_WORKERS,
+        max_queued_recommendations: int = DEFAULT_MAX_QUEUED,
+    ):
         self.storage = storage
         self.app = app
         self.db = db
         self.ml = ml
-        self.MAX_PHOTO_INPUT = 10
+        self.catalog = catalog
+        self.quota = quota
+        self.prediction_cache = prediction_cache
+        self.normalizer = normalizer
+        self.food_table = food_table
+        self.recommender = recommender
+        self.recommendation_jobs = JobQueue(
+            "recommendation",
+            handler=self.generate_recommendation,
+            workers=recommendation_workers,
+            max_queued=max_queued_recommendations,
+        )
 
-    def upload_nutrition_photo(self, file: BinaryIO, user_id: str, content_type: str):
-        user_input = self.db.get_count_nutrition_input_today(user_id=user_id)
-        if user_input == self.MAX_PHOTO_INPUT:
+    @traced
+    async def upload_nutrition_photo(
+        self, file: BinaryIO, user_id: str, content_type: str
+    ):
+        return await self.__metered(
+            user_id, [UPLOAD], lambda: self.__upload_nutrition_photo(file, user_id)
+        )
+
+    @traced
+    async def predict_food(
+        self, file: BinaryIO, content_type: str, user_id: str, keep: bool = False
+    ):
+        # a kept scan is an upload as well and counts against that quota
+        kinds = [SCAN, UPLOAD] if keep else [SCAN]
+        return await self.__metered(
+            user_id, kinds, lambda: self.__predict_food(file, user_id, keep)
+        )
+
+    async def __metered(
+        self, user_id: str, kinds: List[str], call: Callable[[], Awaitable[Dict]]
+    ) -> Dict:
+        # The quota is taken before the work starts, so parallel requests
+        # can't go over it, and given back when the work doesn't succeed.
+        day = await self.quota.reserve(user_id, *kinds)
+        if day is None:
             return result.Err(
                 code=400,
                 msg="You have reached the maximum photo you can upload. Try again tomorrow",
             )
 
+        try:
+            resp = await call()
+        except BaseException:
+            await self.quota.refund(user_id, day, *kinds)
+            raise
+
+        if resp["code"] >= 300:
+            await self.quota.refund(user_id, day, *kinds)
+
+        return resp
+
+    async def __upload_nutrition_photo(self, file: BinaryIO, user_id: str) -> Dict:
+        data = await run_in_threadpool(read_photo, file, self.storage.max_upload_bytes)
+        normalized = await self.normalizer.normalize(data)
+
         path = f"{user_id}/nutrition"
-        uploaded_photo_url = self.storage.store(
-            path=path, file=file, content_type=content_type
+        uploaded_photo_url, generation = await self.storage.store(
+            path=path,
+            file=io.BytesIO(normalized),
+            content_type=self.normalizer.content_type,
         )
 
-        saved_result = self.db.save_nutrition_data(
-            user_id=user_id, img_url=uploaded_photo_url
+        saved_result = await self.db.save_nutrition_data(
+            user_id=user_id, img_url=uploaded_photo_url, img_generation=generation
         )
 
         return result.OK(data=saved_result)
 
-    def predict_food(self, file: BinaryIO, content_type: str, user_id: str):
-        user_upload_today = self.db.get_user_scan_count(user_id)
-        if user_upload_today >= self.MAX_PHOTO_INPUT:
-            return result.Err(
-                code=400,
-                msg="You have reached the maximum photo you can upload. Try again tomorrow",
-            )
+    async def __predict_food(self, file: BinaryIO, user_id: str, keep: bool) -> Dict:
+        data = await run_in_threadpool(read_photo, file, self.storage.max_upload_bytes)
 
-        path = f"temp"
-        uploaded_photo_url = self.storage.store(
-            path=path, file=file, content_type=content_type
+        # the profile is read while the photo is being classified
+        user_detail, (prediction_result, normalized) = await asyncio.gather(
+            self.db.get_user_detail(user_id), self.__classify(data)
         )
 
-        self.db.increment_user_scan_count(user_id)
+        eat_per_day = user_detail["eat_per_day"]
+        label = prediction_result["final_result"]
+        final_result = self.catalog.resolve(label)
+        if final_result is None:
+            # only in Firestore, and the catalog still holds just the seed
+            final_result = await self.catalog.resolve_loaded(label)
+        if final_result is None:
+            # not in the snapshot yet (e.g. added after startup)
+            final_result = await self.db.get_food_by_name(label)
+        if final_result is None:
+            print("NutritionService.predict_food: unknown label", label)
+            return result.Err(code=404, msg="The food is not in our catalog yet")
 
-        prediction_result = self.ml.predict_food(uploaded_photo_url)
-        eat_per_day = self.db.get_user_detail(user_id)["eat_per_day"]
-        final_result = self.db.get_food_by_name(prediction_result["final_result"])
+        # the photo is only stored when the user keeps the scan
+        saved_scan = None
+        if keep:
+            if normalized is None:
+                normalized = await self.normalizer.normalize(data)
 
+            uploaded_photo_url, generation = await self.storage.store(
+                path=f"{user_id}/nutrition",
+                file=io.BytesIO(normalized),
+                content_type=self.normalizer.content_type,
+            )
+            saved_scan = await self.db.save_nutrition_data(
+                user_id=user_id, img_url=uploaded_photo_url, img_generation=generation
+            )
+
+        calories_key = "calories_for_4x"
         if eat_per_day == 2 or eat_per_day == "2":
-            resp = {
-                "id": final_result["id"],
-                "name": final_result["name"],
-                "calories": final_result["calories_for_2x"],
-                "karbohidrat": final_result["karbohidrat"],
-                "lemak": final_result["lemak"],
-                "mineral": final_result["mineral"],
-                "protein": final_result["protein"],
-                "vitamin": final_result["vitamin"],
-                "img": final_result["img"],
-            }
-
-            return result.OK(data=resp)
-
-        if eat_per_day == 3 or eat_per_day == "3":
-            resp = {
-                "id": final_result["id"],
-                "name": final_result["name"],
-                "calories": final_result["calories_for_3x"],
-                "karbohidrat": final_result["karbohidrat"],
-                "lemak": final_result["lemak"],
-                "mineral": final_result["mineral"],
-                "protein": final_result["protein"],
-                "vitamin": final_result["vitamin"],
-                "img": final_result["img"],
-            }
-
-            return result.OK(data=resp)
+            calories_key = "calories_for_2x"
+        elif eat_per_day == 3 or eat_per_day == "3":
+            calories_key = "calories_for_3x"
 
         resp = {
             "id": final_result["id"],
             "name": final_result["name"],
-            "calories": final_result["calories_for_4x"],
+            "calories": final_result[calories_key],
             "karbohidrat": final_result["karbohidrat"],
             "lemak": final_result["lemak"],
             "mineral": final_result["mineral"],
             "protein": final_result["protein"],
             "vitamin": final_result["vitamin"],
             "img": final_result["img"],
+            "other_options": self.__other_options(
+                prediction_result["other_options"], final_result, calories_key
+            ),
         }
 
-        self.db.increment_user_scan_count(user_id)
+        if saved_scan is not None:
+            resp["saved"] = saved_scan
 
         return result.OK(data=resp)
 
-    def get_recommendation_food(self, user_id: str):
-        user = self.db.get_user_detail(user_id)
-        if user["has_been_updated"] is False:
+    def __other_options(
+        self, labels: List[str], final_result: Dict, calories_key: str
+    ) -> List[Dict]:
+        # labels that don't resolve, or resolve to the final result, are left out
+        options = []
+        seen = {final_result["id"]}
+        for label in labels:
+            food = self.catalog.resolve(label)
+            if food is None or food["id"] in seen:
+                continue
+
+            seen.add(food["id"])
+            options.append(
+                {"id": food["id"], "name": food["name"], "calories": food[calories_key]}
+            )
+
+        return options
+
+    @traced
+    async def __classify(self, data: bytes) -> Tuple[dict, Optional[bytes]]:
+        # keyed on the raw bytes so a hit skips normalisation as well
+        cache_key = self.prediction_cache.key(data)
+
+        prediction_result = await self.prediction_cache.get(cache_key)
+        if prediction_result is not None:
+            return prediction_result, None
+
+        normalized = await self.normalizer.normalize(data)
+        prediction_result = await self.ml.predict_food(
+            normalized, self.normalizer.content_type
+        )
+        await self.prediction_cache.set(cache_key, prediction_result)
+
+        return prediction_result, normalized
+
+    @traced
+    async def get_recommendation_food(self, user_id: str):
+        # the profile is read past the cache, a change made through another
+        # worker has to show up here
+        profile, saved = await asyncio.gather(
+            self.db.read_user_detail(user_id),
+            self.db.get_recommendation_food(user_id),
+        )
+        if profile is None or profile[0]["has_been_updated"] is False:
             return result.Err(
                 400,
                 "Can't generate recommendation. Please fill the data first in the profile.",
             )
 
-        print(user)
+        _, profile_version = profile
+        if saved is not None:
+            recommendation, made_from = saved
+            if made_from == profile_version:
+                return result.OK(data=recommendation)
 
-        resp = self.db.get_recommendation_food(user_id, user["eat_per_day"])
-        if resp is None:
-            return result.Err(code=423, msg="Still generating. Please wait")
+        # none yet, or made from an older profile; a job this worker already
+        # has for the user is polled, not submitted again
+        job = self.recommendation_jobs.status(user_id)
+        if job is None:
+            job = self.recommendation_jobs.submit(user_id)
+            if job is None:
+                return result.Err(
+                    code=503,
+                    msg="Too many recommendations are being generated. Try again later",
+                )
+
+        job["retry_after"] = RECOMMENDATION_RETRY_SECONDS
+        return result.Accepted(msg="Still generating. Please wait", data=job)
+
+    def schedule_recommendation(self, user_id: str):
+        # called when the profile changes, a burst of edits makes one job
+        if self.recommendation_jobs.submit(user_id) is None:
+            print("NutritionService.schedule_recommendation: queue full,", user_id)
+
+    @traced
+    async def generate_recommendation(self, user_id: str):
+        profile = await self.db.read_user_detail(user_id)
+        if profile is None or profile[0]["has_been_updated"] is False:
+            return
+
+        user, profile_version = profile
+        recommendation = await run_in_threadpool(
+            self.recommender.recommend,
+            calories_target=user["calories_target"],
+            eat_per_day=user["eat_per_day"],
+            sex=user["sex"],
+            age=user["age"],
+            weight=user["weight"],
+            height=user["height"],
+        )
+        await self.db.save_recommendation_food(
+            user_id, recommendation, profile_version=profile_version
+        )
+
+    @traced
+    async def search_foods(
+        self,
+        ranges: Optional[List[str]] = None,
+        kelompok_makanan: Optional[List[str]] = None,
+        jenis_olahan: Optional[List[str]] = None,
+        fast_food: Optional[bool] = None,
+        sort: str = "name",
+        page: int = 1,
+        page_size: int = 20,
+    ):
+        # `ranges` are "nutrient:min:max", either bound may be left empty
+        parsed: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        for item in ranges or []:
+            try:
+                name, low, high = item.split(":")
+                parsed[name] = (
+                    float(low) if low != "" else None,
+                    float(high) if high != "" else None,
+                )
+            except ValueError:
+                return result.BadInput(
+                    {"range": f"{item} is not in the nutrient:min:max form"}
+                )
+
+            if name not in NUTRIENT_COLUMNS:
+                return result.BadInput({"range": f"Unknown nutrient {name}"})
+
+        descending = sort.startswith("-")
+        sort = sort.lstrip("-")
+        if sort != "name" and sort not in NUTRIENT_COLUMNS:
+            return result.BadInput({"sort": f"Can't sort by {sort}"})
+
+        categories = {}
+        if kelompok_makanan:
+            categories["kelompok_makanan"] = kelompok_makanan
+        if jenis_olahan:
+            categories["jenis_olahan"] = jenis_olahan
+        if fast_food is not None:
+            categories["fast_food"] = ["Ya" if fast_food else "Tidak"]
+
+        total, rows = self.food_table.query(
+            ranges=parsed,
+            categories=categories,
+            sort=sort,
+            descending=descending,
+            offset=(page - 1) * page_size,
+            limit=page_size,
+        )
+
+        resp = {
+            "foods": [self.food_table.food(i) for i in rows],
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+        }
 
         return result.OK(data=resp)
 
-    def get_count_photo_today(self, user_id: str):
-        count = self.db.get_count_nutrition_input_today(user_id=user_id)
+    @traced
+    async def get_count_photo_today(self, user_id: str):
+        count = await self.quota.used(user_id, UPLOAD)
 
         resp = {"count": count}
 
@@ -0,0 +1,65 @@
+import datetime
+from typing import Optional
+
+import pytz
+
+from .gcp.firestore import Firestore
+from .metrics import QUOTA_REJECTIONS
+
+SCAN = "scan"
+UPLOAD = "upload"
+
+DEFAULT_DAILY_LIMIT = 10
+
+
+class Quota:
+    """
+    Per-user daily counters for scans and uploads.
+
+    Each user gets one counter document per day (Asia/Jakarta), so the
+    count resets at local midnight without any cleanup job. Checking and
+    incrementing happen in a single Firestore transaction.
+    """
+
+    def __init__(self, db: Firestore, limit: int = DEFAULT_DAILY_LIMIT):
+        self.db = db
+        self.limit = limit
+
+    async def consume(self, user_id: str, kind: str) -> bool:
+        return await self.__consume(user_id, self.__today(), kind)
+
+    async def reserve(self, user_id: str, *kinds: str) -> Optional[str]:
+        # Consumes one of every kind, or none of them. Returns the day they
+        # were counted on, to refund() them, or None when one is used up.
+        day = self.__today()
+        consumed = []
+        for kind in kinds:
+            if not await self.__consume(user_id, day, kind):
+                await self.refund(user_id, day, *consumed)
+                return None
+            consumed.append(kind)
+
+        return day
+
+    async def refund(self, user_id: str, day: str, *kinds: str):
+        for kind in kinds:
+            await self.db.release_daily_quota(user_id=user_id, day=day, kind=kind)
+
+    async def used(self, user_id: str, kind: str) -> int:
+        return await self.db.get_daily_quota(
+            user_id=user_id, day=self.__today(), kind=kind
+        )
+
+    async def __consume(self, user_id: str, day: str, kind: str) -> bool:
+        count = await self.db.consume_daily_quota(
+            user_id=user_id, day=day, kind=kind, limit=self.limit
+        )
+        if count is None:
+            QUOTA_REJECTIONS.labels(kind).inc()
+            return False
+
+        return True
+
+    def __today(self) -> str:
+        tz_jakarta = pytz.timezone("Asia/Jakarta")
+        return datetime.datetime.now(tz_jakarta).strftime("%Y-%m-%d")
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+DEFAULT_START_TIMEOUT_SECONDS = 20.0
+# a dependency that failed to start is retried with backoff up to this delay
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+
+class _Dependency:
+    def __init__(
+        self,
+        name: str,
+        start: Callable[[], Awaitable],
+        requires: List[str],
+        optional: bool,
+    ):
+        self.name = name
+        self.start = start
+        self.requires = requires
+        self.optional = optional
+        self.ready = asyncio.Event()
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.started_in_ms: Optional[float] = None
+
+
+class Readiness:
+    """
+    Starts the app's dependencies concurrently and tracks which are usable.
+
+    Every dependency is started as soon as the ones it `requires` are
+    ready, so independent ones overlap their network round trips. A
+    dependency that fails is reported with its error and retried in the
+    background, and the instance only counts as ready once all of them
+    have started. An `optional` one is started and reported the same way,
+    but the instance doesn't wait for it.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_START_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self.dependencies: Dict[str, _Dependency] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(
+        self,
+        name: str,
+        start: Callable[[], Awaitable],
+        requires: Optional[List[str]] = None,
+        optional: bool = False,
+    ):
+        self.dependencies[name] = _Dependency(name, start, requires or [], optional)
+
+    def start(self):
+        # returns at once, the dependencies start in a background task
+        self._task = asyncio.get_running_loop().create_task(self.__start_all())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def ready(self) -> bool:
+        return all(d.ready.is_set() for d in self.__required())
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        waits = [d.ready.wait() for d in self.__required()]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        return self.ready
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "dependencies": {
+                d.name: {
+                    "ready": d.ready.is_set(),
+                    "optional": d.optional,
+                    "error": d.error,
+                    "attempts": d.attempts,
+                    "started_in_ms": d.started_in_ms,
+                }
+                for d in self.dependencies.values()
+            },
+        }
+
+    def __required(self) -> List[_Dependency]:
+        return [d for d in self.dependencies.values() if not d.optional]
+
+    async def __start_all(self):
+        await asyncio.gather(*(self.__start(d) for d in self.dependencies.values()))
+
+    async def __start(self, dependency: _Dependency):
+        for name in dependency.requires:
+            await self.dependencies[name].ready.wait()
+
+        delay = 1.0
+        while True:
+            dependency.attempts += 1
+            start = time.perf_counter()
+
+            try:
+                await asyncio.wait_for(dependency.start(), self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                dependency.error = f"{type(e).__name__}: {e}"
+                print(f"Readiness.start: {dependency.name}:", dependency.error)
+
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY_SECONDS)
+                continue
+
+            dependency.started_in_ms = (time.perf_counter() - start) * 1000
+            dependency.error = None
+            dependency.ready.set()
+            return
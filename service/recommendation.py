@@ -0,0 +1,178 @@
+from typing import Dict
+
+import numpy as np
+
+from .food_table import FoodTable
+
+TOP_FOODS = 15
+COMBINATIONS = 20
+
+# share of the daily energy every meal takes, by meals per day
+MEAL_SHARES = {
+    2: {"Lunch": 0.5, "Dinner": 0.5},
+    3: {"Breakfast": 0.3, "Lunch": 0.4, "Dinner": 0.3},
+    4: {"Breakfast": 0.25, "Lunch": 0.35, "Dinner": 0.3, "Snacks": 0.1},
+}
+SNACK_MEALS = {"Snacks"}
+
+# the best foods of every meal that the combinations are built from, fewer
+# when there are more meals so the grid stays around 10-20k combinations
+CANDIDATES = {2: 60, 3: 24, 4: 12}
+
+SCORED = ["energi", "protein", "lemak", "karbohidrat", "serat", "natrium"]
+# how much a relative miss on every SCORED nutrient costs
+WEIGHTS = np.array([3.0, 1.0, 1.0, 1.0, 0.5, 1.0])
+# fibre only counts when short of the target, sodium only above the limit
+SHORTFALL_ONLY = np.array([False, False, False, False, True, False])
+EXCESS_ONLY = np.array([False, False, False, False, False, True])
+
+# share of the daily energy from protein, fat and carbohydrate and their
+# kcal per gram (PUGS)
+MACROS = {"protein": (0.15, 4.0), "lemak": (0.25, 9.0), "karbohidrat": (0.60, 4.0)}
+DAILY_SODIUM_MG = 2000.0
+
+# AKG 2019 fibre in g/day by the age every band starts at; younger users get
+# 14 g per 1000 kcal
+ADULT_FIBER = {
+    "M": ((19, 37.0), (30, 36.0), (50, 30.0), (65, 25.0), (80, 22.0)),
+    "F": ((19, 32.0), (30, 30.0), (50, 25.0), (65, 22.0), (80, 20.0)),
+}
+FIBER_PER_KCAL = 14.0 / 1000
+
+# without a calories target, Mifflin-St Jeor with light activity
+ACTIVITY_FACTOR = 1.375
+DEFAULT_DAILY_KCAL = 2100.0
+
+# a serving is between these many times the 100 g of the table
+MIN_PORTION = 0.5
+MAX_PORTION = 3.0
+
+
+class RecommendationEngine:
+    """
+    Builds a user's food recommendation from the nutrients in FoodTable.
+
+    Every food is scaled to the portion that fits a meal's energy share
+    and scored on how far its protein, fat, carbohydrate, fibre and sodium
+    land from the meal's target. The meal combinations are scored the same
+    way on their daily totals, over the product of the best candidates of
+    every meal. It is all array arithmetic, a recommendation takes a few
+    milliseconds.
+    """
+
+    def __init__(self, table: FoodTable):
+        self.table = table
+        self.values = table.columns(SCORED)
+        self.energy = self.values[:, 0]
+
+        snacks = table.is_category("tipe", "Makanan Ringan")
+        self.snacks = snacks & (self.energy > 0)
+        self.meals = ~snacks & (self.energy > 0)
+
+    def recommend(
+        self,
+        calories_target: int,
+        eat_per_day: int,
+        sex: str,
+        age: int,
+        weight: int = 0,
+        height: int = 0,
+    ) -> Dict:
+        eat_per_day = min(max(int(eat_per_day), 2), 4)
+        meals = MEAL_SHARES[eat_per_day]
+
+        energy = float(calories_target)
+        if energy <= 0:
+            energy = estimate_daily_kcal(sex, age, weight, height)
+        daily = self.__daily_targets(energy, sex, age)
+
+        # (meal, target) and (meal, food, nutrient) for a serving sized to
+        # the meal's energy
+        targets = np.array(list(meals.values()))[:, None] * daily
+        portions = np.clip(
+            targets[:, :1] / self.energy[None, :], MIN_PORTION, MAX_PORTION
+        )
+        servings = portions[:, :, None] * self.values[None, :, :]
+
+        errors = _error(servings, targets[:, None, :])
+        allowed = np.array(
+            [self.snacks if meal in SNACK_MEALS else self.meals for meal in meals]
+        )
+        errors[~allowed] = np.inf
+
+        top15 = np.argsort(errors.min(axis=0), kind="stable")[:TOP_FOODS]
+
+        return {
+            "top15": [
+                {"id": self.table.ids[i], "name": self.table.names[i]} for i in top15
+            ],
+            "recom": [
+                {meal: self.table.names[i] for meal, i in zip(meals, combination)}
+                for combination in self.__combinations(servings, errors, daily)
+            ],
+        }
+
+    def __combinations(
+        self, servings: np.ndarray, errors: np.ndarray, daily: np.ndarray
+    ) -> np.ndarray:
+        meal_count = errors.shape[0]
+        k = CANDIDATES[meal_count]
+        candidates = np.argsort(errors, axis=1, kind="stable")[:, :k]
+
+        # every pick of one candidate per meal, as rows of food indexes
+        grid = np.meshgrid(*candidates, indexing="ij")
+        combinations = np.stack(grid, axis=-1).reshape(-1, meal_count)
+
+        meal_rows = np.arange(meal_count)
+        totals = servings[meal_rows, combinations].sum(axis=1)
+        scores = _error(totals, daily)
+        scores += errors[meal_rows, combinations].sum(axis=1) / meal_count
+
+        # The same food twice in a day is left out, and of the orders of the
+        # same foods over the meals only the best one is kept. A set of foods
+        # is keyed by its sorted indexes written as one base-n number.
+        foods = np.sort(combinations, axis=1)
+        distinct = np.all(np.diff(foods, axis=1) > 0, axis=1) & np.isfinite(scores)
+        combinations, scores = combinations[distinct], scores[distinct]
+        keys = foods[distinct] @ (len(self.table) ** meal_rows)
+
+        order = np.argsort(scores, kind="stable")
+        _, first = np.unique(keys[order], return_index=True)
+
+        return combinations[order[np.sort(first)[:COMBINATIONS]]]
+
+    def __daily_targets(self, energy: float, sex: str, age: int) -> np.ndarray:
+        macros = [energy * share / kcal for share, kcal in MACROS.values()]
+        fiber = daily_fiber(sex, age, energy)
+
+        return np.array([energy, *macros, fiber, DAILY_SODIUM_MG])
+
+
+def _error(values: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    # weighted squared relative miss over the last axis
+    miss = (values - targets) / targets
+    miss = np.where(SHORTFALL_ONLY, np.minimum(miss, 0), miss)
+    miss = np.where(EXCESS_ONLY, np.maximum(miss, 0), miss)
+
+    return (WEIGHTS * miss**2).sum(axis=-1)
+
+
+def daily_fiber(sex: str, age: int, energy: float) -> float:
+    bands = ADULT_FIBER.get(sex, ADULT_FIBER["M"])
+    if age < bands[0][0]:
+        return energy * FIBER_PER_KCAL
+
+    fiber = bands[0][1]
+    for start, grams in bands:
+        if age >= start:
+            fiber = grams
+
+    return fiber
+
+
+def estimate_daily_kcal(sex: str, age: int, weight: int, height: int) -> float:
+    if weight <= 0 or height <= 0 or age <= 0:
+        return DEFAULT_DAILY_KCAL
+
+    bmr = 10 * weight + 6.25 * height - 5 * age + (5 if sex == "M" else -161)
+    return bmr * ACTIVITY_FACTOR
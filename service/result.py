@@ -22,6 +22,10 @@ def Created(data: Any = None):
     return Result(201, "Created", data).build()
 
 
+def Accepted(msg: str, data: Any = None):
+    return Result(202, msg, data).build()
+
+
 def Err(code: int, msg: str, data: Any = None):
     return Result(code, msg, data).build()
 
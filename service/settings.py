@@ -1,13 +1,18 @@
+import io
 import json
 from typing import Any, BinaryIO, Optional
 
 from firebase_admin import auth
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from . import result
 from .authentication import AuthService
 from .gcp.firestore import Firestore
 from .gcp.storage import Storage
+from .image import ImageNormalizer, read_photo
+from .nutrition import NutritionService
+from .tracing import traced
 
 from collections import ChainMap
 
@@ -22,14 +27,19 @@ class SettingsService:
         db: Firestore,
         api_key: str,
         auth_service: AuthService,
+        normalizer: ImageNormalizer,
+        nutrition_service: NutritionService,
     ):
         self.storage = storage
         self.app = app
         self.db = db
         self.api_key = api_key
         self.auth_service = auth_service
+        self.normalizer = normalizer
+        self.nutrition_service = nutrition_service
 
-    def update_profile(
+    @traced
+    async def update_profile(
         self,
         name: str,
         file: Optional[BinaryIO],
@@ -43,7 +53,7 @@ class SettingsService:
         eat_per_day: int,
         refresh_token: str,
     ):
-        if not self.db.is_user_exists(user.user_id):
+        if not await self.db.is_user_exists(user.user_id):
             raise HTTPException(status_code=401, detail="Unauthorized")
 
         if sex not in ["M", "F"]:
@@ -52,45 +62,75 @@ class SettingsService:
         uploaded_photo_url = ""
 
         if file is not None:
-            if user.photo_url != "":
-                photo_id = user.photo_url.split("/")[-1]
-                path = f"{user.user_id}/profile"
-
-                self.storage.destruct(path=path, photo_id=photo_id)
-                uploaded_photo_url = self.storage.store(
-                    path=path, file=file, content_type=content_type
-                )
-            else:
-                path = f"{user.user_id}/profile"
-                uploaded_photo_url = self.storage.store(
-                    path=path, file=file, content_type=content_type
-                )
+            # normalise first, a photo that can't be decoded must not cost
+            # the user their current one
+            data = await run_in_threadpool(
+                read_photo, file, self.storage.max_upload_bytes
+            )
+            file = io.BytesIO(await self.normalizer.normalize(data))
+            content_type = self.normalizer.content_type
+
+            path = f"{user.user_id}/profile"
+            uploaded_photo_url, generation = await self.storage.store(
+                path=path, file=file, content_type=content_type
+            )
+            photo_id = uploaded_photo_url.split("/")[-1]
 
         try:
             if uploaded_photo_url == "":
-                auth.update_user(
+                await run_in_threadpool(
+                    auth.update_user,
                     uid=user.user_id,
                     display_name=name,
                 )
 
             else:
-                auth.update_user(
-                    uid=user.user_id, display_name=name, photo_url=uploaded_photo_url
+                await run_in_threadpool(
+                    auth.update_user,
+                    uid=user.user_id,
+                    display_name=name,
+                    photo_url=uploaded_photo_url,
                 )
         except ValueError:
             if uploaded_photo_url != "":
-                self.storage.destruct(path=path, photo_id=photo_id)
+                await self.storage.destruct(
+                    path=path, photo_id=photo_id, generation=generation
+                )
 
             return result.Err(code=400, msg="Invalid user")
 
         except Exception as e:
             print("SettingsService.update_profile:", e)
             if uploaded_photo_url != "":
-                self.storage.destruct(path=path, photo_id=photo_id)
+                await self.storage.destruct(
+                    path=path, photo_id=photo_id, generation=generation
+                )
 
             return result.InternalErr()
 
-        updated_data = self.db.save_user_detail(
+        # the old photo only goes once the profile points at the new one. The
+        # recorded one is deleted only if its blob is still that upload; the
+        # token's photo is the fallback for profiles from before the record
+        if uploaded_photo_url != "":
+            old_photo = await self.db.get_profile_photo(user.user_id)
+            await self.db.save_profile_photo(
+                user.user_id, uploaded_photo_url, generation
+            )
+
+            old_photo_url, old_generation = user.photo_url, None
+            if old_photo is not None:
+                old_photo_url, old_generation = (
+                    old_photo["url"],
+                    old_photo["generation"],
+                )
+
+            if f"/{path}/" in old_photo_url:
+                old_photo_id = old_photo_url.split("/")[-1]
+                await self.storage.destruct(
+                    path=path, photo_id=old_photo_id, generation=old_generation
+                )
+
+        updated_data = await self.db.save_user_detail(
             weight=weight,
             height=height,
             sex=sex,
@@ -104,7 +144,9 @@ class SettingsService:
             print("gabisa update data")
             return result.InternalErr()
 
-        token = self.auth_service.refresh_token(refresh_token=refresh_token)
+        self.nutrition_service.schedule_recommendation(user.user_id)
+
+        token = await self.auth_service.refresh_token(refresh_token=refresh_token)
 
         resp = {
             "id": token["data"]["id"],
@@ -120,11 +162,18 @@ class SettingsService:
 
         return result.OK(data=updated_result)
 
-    def get_upload_nutrition_photo_history(self, user_id: str, page: int = 0):
-        paginated_photos = self.db.get_all_user_nutrition_photo(
-            user_id=user_id, skip=page
-        )
-        return result.OK(data=paginated_photos)
+    @traced
+    async def get_upload_nutrition_photo_history(
+        self, user_id: str, cursor: Optional[str] = None, page_size: int = 10
+    ):
+        try:
+            photos, next_cursor = await self.db.get_all_user_nutrition_photo(
+                user_id=user_id, cursor=cursor, page_size=page_size
+            )
+        except ValueError:
+            return result.Err(code=400, msg="Invalid cursor")
+
+        return result.OK(data={"photos": photos, "next_cursor": next_cursor})
 
     def _extract_response_text(self, data: Any, key: str) -> str:
         data = json.loads(data)
@@ -0,0 +1,287 @@
+import contextlib
+import functools
+import json
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+# OTLP SpanKind and StatusCode values
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+SERVICE_NAME = "nusa-api"
+
+# traces waiting for the writer thread
+DEFAULT_MAX_QUEUED_TRACES = 10_000
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        kind: int,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        local_root: bool,
+        trace: List["Span"],
+    ):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.local_root = local_root
+        self.trace = trace
+        self.attributes: Dict[str, Any] = {}
+        self.status = STATUS_OK
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": self.status},
+        }
+        if self.parent_span_id is not None:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+
+        return span
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonFileExporter:
+    """
+    Appends one OTLP/JSON `ExportTraceServiceRequest` per trace to a file,
+    one per line. That's the layout the OpenTelemetry Collector's
+    otlpjsonfile receiver reads, so the file can be shipped to any OTLP
+    backend as it is.
+
+    export() is called on the event loop, so it only queues the trace. A
+    writer thread encodes and appends it; when the queue is full, because
+    the disk can't keep up, traces are dropped rather than waited for.
+    """
+
+    def __init__(self, path: str, max_queued: int = DEFAULT_MAX_QUEUED_TRACES):
+        self.path = path
+        self.max_queued = max_queued
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self, spans: List[Span]):
+        try:
+            self.__queue().put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self, timeout: float = 5.0):
+        # writes out what is queued, the thread exits after the None
+        if self._pid != os.getpid():
+            return
+
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def __queue(self) -> queue.Queue:
+        # the writer thread is started by the process that exports: a thread
+        # started before a gunicorn fork doesn't exist in the workers
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queued)
+                    self._thread = threading.Thread(
+                        target=self.__write,
+                        args=(self._queue,),
+                        name="tracing-export",
+                        daemon=True,
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+        return self._queue
+
+    def __write(self, traces: queue.Queue):
+        fd = None
+        while True:
+            spans = traces.get()
+            if spans is None:
+                break
+
+            try:
+                if fd is None:
+                    fd = os.open(
+                        self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+                    )
+                # a single append per trace keeps lines from several workers
+                # apart
+                os.write(fd, self.__encode(spans))
+            except OSError as e:
+                print("tracing.JsonFileExporter:", e)
+
+        if fd is not None:
+            os.close(fd)
+
+    def __encode(self, spans: List[Span]) -> bytes:
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            },
+                            {
+                                "key": "process.pid",
+                                "value": {"intValue": str(os.getpid())},
+                            },
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "service.tracing"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        return (json.dumps(request, separators=(",", ":")) + "\n").encode()
+
+
+_exporter: Optional[JsonFileExporter] = None
+_min_duration_ns = 0
+
+_current_span: ContextVar[Optional[Span]] = ContextVar(
+    "tracing_current_span", default=None
+)
+
+
+def configure(path: Optional[str], min_duration_ms: float = 0.0):
+    # Tracing is off while `path` is None, and span() costs next to nothing.
+    # Traces whose root took less than `min_duration_ms` are dropped, so
+    # the file can be kept to the slow requests only.
+    global _exporter, _min_duration_ns
+
+    _exporter = JsonFileExporter(path) if path else None
+    _min_duration_ns = int(min_duration_ms * 1_000_000)
+
+
+def shutdown():
+    if _exporter is not None:
+        _exporter.shutdown()
+
+
+@contextlib.contextmanager
+def span(
+    name: str,
+    kind: int = INTERNAL,
+    attributes: Optional[Dict[str, Any]] = None,
+    traceparent: Optional[str] = None,
+):
+    if _exporter is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    if parent is not None:
+        current = Span(name, kind, parent.trace_id, parent.span_id, False, parent.trace)
+    else:
+        trace_id, parent_span_id = _parse_traceparent(traceparent)
+        current = Span(name, kind, trace_id, parent_span_id, True, [])
+
+    current.attributes.update(attributes or {})
+
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        current.trace.append(current)
+
+        if current.local_root and _exporter is not None:
+            if current.end_ns - current.start_ns >= _min_duration_ns:
+                _exporter.export(current.trace)
+
+
+def traced(fn: Callable) -> Callable:
+    # Opens a span named after the method around an async function.
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with span(fn.__qualname__):
+            return await fn(*args, **kwargs)
+
+    return wrapper
+
+
+def headers() -> Dict[str, str]:
+    # W3C trace context for outbound requests, empty outside of a span
+    current = _current_span.get()
+    if current is None:
+        return {}
+
+    return {"traceparent": f"00-{current.trace_id}-{current.span_id}-01"}
+
+
+def _parse_traceparent(traceparent: Optional[str]):
+    # continues the caller's trace when it sent a valid W3C traceparent
+    if traceparent is not None:
+        parts = traceparent.strip().split("-")
+        if (
+            len(parts) == 4
+            and len(parts[1]) == 32
+            and len(parts[2]) == 16
+            and parts[1] != "0" * 32
+            and parts[2] != "0" * 16
+        ):
+            try:
+                int(parts[1], 16), int(parts[2], 16)
+                return parts[1].lower(), parts[2].lower()
+            except ValueError:
+                pass
+
+    return os.urandom(16).hex(), None
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from service.gcp.firestore import _DocumentLoader
+
+
+class Ref:
+    def __init__(self, path):
+        self.path = path
+
+
+class Snapshot:
+    def __init__(self, reference):
+        self.reference = reference
+
+
+class SlowDB:
+    # answers get_all after a short wait, so a waiter can be cancelled first
+    def __init__(self):
+        self.calls = 0
+
+    async def get_all(self, refs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        for ref in refs:
+            yield Snapshot(ref)
+
+
+def test_cancelled_waiter_does_not_fail_the_batch():
+    async def run():
+        db = SlowDB()
+        loader = _DocumentLoader(db)
+
+        cancelled = asyncio.ensure_future(loader.load(Ref("user_detail/a")))
+        surviving_same_key = loader.load(Ref("user_detail/a"))
+        surviving_other_key = loader.load(Ref("user_detail/b"))
+
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        a = await surviving_same_key
+        b = await surviving_other_key
+
+        assert a.reference.path == "user_detail/a"
+        assert b.reference.path == "user_detail/b"
+        assert db.calls == 1
+
+        # the read stays remembered for the rest of the request
+        again = await loader.load(Ref("user_detail/a"))
+        assert again is a
+        assert db.calls == 1
+
+    asyncio.run(run())
@@ -0,0 +1,17 @@
+from service.labels import LabelIndex
+
+
+def index(*names):
+    return LabelIndex([{"name": name, "id": name} for name in names])
+
+
+def test_misspelling_resolves_to_the_only_close_name():
+    labels = index("Ayam Goreng", "Ikan Patin bakar")
+
+    assert labels.resolve("Ayam Gorng")["name"] == "Ayam Goreng"
+
+
+def test_generic_label_does_not_resolve_to_a_specific_dish():
+    labels = index("Ikan Patin bakar", "Ikan Mas bakar")
+
+    assert labels.resolve("Ikan Bakar") is None